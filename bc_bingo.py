@@ -1,22 +1,41 @@
 #!/usr/bin/env python
 import sys
+import os
 import re
 import glob
 import random
 import csv
+import io
 import time
-import itertools
+import hashlib
+import mimetypes
+import functools
+import importlib.util
 
 try:
     from htmlBuilder import tags, attributes
-    import markdown
+    # markdown is only imported once the rules are first rendered
+    if importlib.util.find_spec("markdown") is None:
+        raise ImportError("markdown")
 except ImportError:
     print("Some non-standard modules need to be installed "
           "in order to run. Please (re-)run:\n"
           "pip install -r requirements.txt")
     sys.exit()
 
-__version__ = "0.1.10"
+from pool_format import BinaryPool
+from _version import __version__
+
+import logging
+log = logging.getLogger(__name__)
+
+def __getattr__(name):
+    # The Flask app (and Flask itself) is only loaded when asked for, e.g.,
+    # by `flask run`, so that CLI use of this module stays light
+    if name == "app":
+        from server import app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 class PreRenderedHtml(tags.HtmlTag):
     def __init__(self, html):
@@ -26,6 +45,209 @@ class PreRenderedHtml(tags.HtmlTag):
     def _render(self, pretty=False, nesting_level=None):
         return self._html
 
+def _pool_key(elem):
+    return (elem["type"], int(elem["choices"] or "1"))
+
+class SegmentPool:
+    """
+    Square pool for a segment file, pre-filtered on segment index and
+    pre-grouped by (type, choices) so that boards can be sampled directly.
+    """
+    def __init__(self, rows, version=None, groups=None):
+        self.rows = rows
+        # Changes whenever the pool contents do, used to key rendered boards
+        self.version = version or \
+                hashlib.sha1(repr(rows).encode("utf8")).hexdigest()[:12]
+
+        # Group in sorted key order, preserving file order within a group,
+        # so sampling is identical to sorting and grouping on the fly.
+        # Compiled pools come already grouped this way.
+        self._groups = groups
+        if groups is None:
+            self._groups = {}
+            for elem in sorted(rows, key=_pool_key):
+                groups = self._groups.setdefault(int(elem["segment_index"]),
+                                                 {})
+                groups.setdefault(_pool_key(elem), []).append(elem)
+
+        # Squares (and their HTML) are immutable, so build them once here
+        self._squares = {
+            elem["index"]: BingoBoard.BingoSquare(elem["square"],
+                                                  elem.get("help"))
+            for elem in rows
+        }
+
+    @classmethod
+    def from_csv(cls, fname):
+        with open(fname, "r") as csvfile:
+            content = csvfile.read()
+
+        version = hashlib.sha1(content.encode("utf8")).hexdigest()[:12]
+        return cls([*csv.DictReader(io.StringIO(content))], version=version)
+
+    def groups(self, segment_index):
+        return self._groups.get(segment_index, {})
+
+    def square(self, elem):
+        return self._squares[elem["index"]]
+
+class MappedSegmentPool:
+    """
+    Segment pool sampled straight from a memory-mapped compiled pool (see
+    pool_format), which forked workers share. Groups are ranges of record
+    numbers, and a record is only decoded into a square, and its HTML
+    built, the first time a board uses it.
+    """
+    def __init__(self, binary, segment_index):
+        self._binary = binary
+        self.version = binary.version
+        self._groups = {segment_index: binary.group_ranges(segment_index)}
+        # record number -> square
+        self._squares = {}
+
+    def groups(self, segment_index):
+        return self._groups.get(segment_index, {})
+
+    def square(self, record):
+        square = self._squares.get(record)
+        if square is None:
+            row = self._binary.row(record)
+            square = self._squares[record] = \
+                    BingoBoard.BingoSquare(row["square"], row["help"])
+        return square
+
+class PoolRegistry:
+    """
+    Process-wide cache of segment pools, keyed on file name. Segment files
+    don't change during a run, so each is read and parsed once.
+    """
+    def __init__(self):
+        self._pools = {}
+        # segment number -> file, as discovered by load_all
+        self.segments = {}
+
+    def __contains__(self, fname):
+        return os.path.normpath(fname) in self._pools
+
+    def load(self, fname):
+        pool = SegmentPool.from_csv(fname)
+        self._pools[os.path.normpath(fname)] = pool
+        return pool
+
+    def load_binary(self, fname):
+        """
+        Map a compiled pool file (see pool_format) and register a pool for
+        each of its segments under their segment CSV names, so boards find
+        them the same way. Boards are the same as from the CSVs.
+        """
+        pool = BinaryPool(fname)
+        for seg in pool.segments:
+            csv_name = f"segments/segment_{seg}.csv"
+            self.segments[seg] = csv_name
+            self._pools[os.path.normpath(csv_name)] = \
+                    MappedSegmentPool(pool, seg)
+        return self
+
+    def load_all(self, pattern="segments/segment_*.csv"):
+        fnames = sorted(glob.glob(pattern))
+        if os.path.exists(POOL_FILE):
+            built = os.path.getmtime(POOL_FILE)
+            stale = [fname for fname in fnames
+                     if os.path.getmtime(fname) > built]
+            if not stale:
+                return self.load_binary(POOL_FILE)
+            log.warning(f"{', '.join(stale)} changed since {POOL_FILE} was "
+                        f"built, using the CSVs. Rebuild it with "
+                        f"utils.convert (or delete it).")
+
+        for fname in fnames:
+            seg = int(fname.replace(".csv", "").split("_")[-1])
+            self.segments[seg] = fname
+            self.load(fname)
+        return self
+
+    def get(self, fname):
+        try:
+            return self._pools[os.path.normpath(fname)]
+        except KeyError:
+            return self.load(fname)
+
+    def clear(self):
+        self._pools.clear()
+        self.segments.clear()
+
+# Compiled pool, used instead of the segment CSVs if present
+POOL_FILE = "segments/pool.bcbp"
+POOLS = PoolRegistry()
+
+# Assets served from memory under versioned URLs, name -> source file
+ASSET_FILES = {
+    "bingo.css": "bingo.css",
+    "toggle.js": "toggle.js",
+    "miab.png": "static/miab.png",
+    "squish.png": "static/squish.png",
+}
+# Versioned URLs never change content, so let clients keep them for a year
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+
+class StaticAsset:
+    def __init__(self, fname, name=None):
+        with open(fname, "rb") as fin:
+            self.data = fin.read()
+
+        self.name = name or os.path.basename(fname)
+        self.mimetype = mimetypes.guess_type(fname)[0] \
+                            or "application/octet-stream"
+        self.last_modified = int(os.path.getmtime(fname))
+        self.version = hashlib.sha1(self.data).hexdigest()[:12]
+
+    @property
+    def url(self):
+        return f"/assets/{self.version}/{self.name}"
+
+class AssetRegistry:
+    """
+    In-memory copies of the page assets, read once and served with
+    content-hashed URLs so browsers can cache them indefinitely.
+    """
+    def __init__(self, files):
+        self._files = files
+        self._assets = {}
+
+    def load(self, name):
+        asset = StaticAsset(self._files[name], name=name)
+        self._assets[name] = asset
+        return asset
+
+    def load_all(self):
+        for name in self._files:
+            self.load(name)
+        return self
+
+    def get(self, name):
+        try:
+            return self._assets[name]
+        except KeyError:
+            return self.load(name)
+
+    def url(self, name):
+        return self.get(name).url
+
+    def clear(self):
+        self._assets.clear()
+
+ASSETS = AssetRegistry(ASSET_FILES)
+
+# Placeholders marking where the seed and squares go in a compiled page
+_SEED_SLOT = "\x00seed\x00"
+_CELL_SLOT = "\x00cell\x00"
+# Seed placeholder for the rules and index, must survive markdown untouched
+_RULES_SEED_SLOT = "BCBINGOSEEDSLOT"
+
+class _CellSlot:
+    def to_div(self):
+        return PreRenderedHtml(_CELL_SLOT)
+
 class BingoBoard:
     class BingoSquare:
         @classmethod
@@ -40,11 +262,14 @@ class BingoBoard:
 
         @property
         def text(self):
-            return self.render_text(self._text)
+            return self._rendered
 
         def __init__(self, text, ttip=None):
             self._text = text
             self._help = ttip
+            self._rendered = self.render_text(text)
+            # compact HTML for the compiled page renderer
+            self.html = self.to_div().render()
 
         def __str__(self):
             if self._help is not None:
@@ -70,49 +295,87 @@ class BingoBoard:
 
         self._seed = seed
         self.pool = self._init_pool(option_pool)
+        # Boards get their own generator so concurrent generation is safe
+        self._rng = random.Random()
 
-    def _init_pool(self, fname):
-        with open(fname, "r") as csvfile:
-            return [*csv.DictReader(csvfile)]
+    def _init_pool(self, option_pool):
+        if isinstance(option_pool, (SegmentPool, MappedSegmentPool)):
+            return option_pool
+        return POOLS.get(option_pool)
 
     def sample_pool(self, segment_index, seed=None):
-        random.seed((seed or self._seed) ^ segment_index)
-        # get groupings and choices
-        def pattr(elem):
-            return (elem["type"], int(elem["choices"] or "1"))
-
-        # Filter on seg index
-        pool = sorted([elem for elem in self.pool
-                if int(elem["segment_index"]) == segment_index],
-                key=pattr)
+        self._rng.seed((seed or self._seed) ^ segment_index)
 
         # group to number of choices and generate from pool
         chosen = []
-        for (t, c), grping in itertools.groupby(pool, pattr):
-            grping = list(grping)
+        for (t, c), grping in self.pool.groups(segment_index).items():
             assert len(grping) >= c, \
                     f"Group {t} has insufficient length to sample {c} items"
-            chosen += random.sample(grping, k=c)
+            chosen += self._rng.sample(grping, k=c)
 
         return [ch for ch in chosen]
 
     def generate(self, segment=None):
         selection = self.sample_pool(segment or self._seg)
-        random.shuffle(selection)
+        self._rng.shuffle(selection)
 
         for col in self._board:
             for i, val in enumerate(col):
                 if val is not None:
                     continue
-                sq = selection.pop()
-                col[i] = self.BingoSquare(sq["square"], sq.get("help"))
+                col[i] = self.pool.square(selection.pop())
 
     def reset(self, ncols, nrows):
         self._board = [[None] * nrows for _ in range(ncols)]
 
+    def to_dict(self):
+        """
+        Plain data version of the board, with 1-based grid positions
+        (so column/row numbers line up with c1-5 / r1-5 bingo lines).
+        """
+        return {
+            "seed": self._seed,
+            "segment": self._seg,
+            "squares": [
+                {
+                    "text": sq._text.replace("__", ""),
+                    "help": sq._help or None,
+                    "col": ci + 1,
+                    "row": ri + 1,
+                }
+                for ci, col in enumerate(self._board)
+                for ri, sq in enumerate(col)
+            ]
+        }
+
+    @classmethod
+    def generate_batch(cls, seeds, segments=None):
+        """
+        Generate boards for every combination of seeds and segments (all
+        segments by default), returned as a list of to_dict() outputs.
+        """
+        if segments is None:
+            segments = sorted(POOLS.segments)
+
+        boards = []
+        for seed in seeds:
+            for seg in segments:
+                board = cls(f"segments/segment_{seg}.csv",
+                            seed=seed, segment=seg)
+                board.generate(seg)
+                boards.append(board.to_dict())
+        return boards
+
 
     @classmethod
     def generate_index(cls, seed, nsegs, from_rules=True):
+        index = cls._compile_index(nsegs, from_rules)
+        return index.replace(_RULES_SEED_SLOT, str(seed))
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _compile_index(cls, nsegs, from_rules=True):
+        seed = _RULES_SEED_SLOT
         head = [
             tags.Title([], "BC Bingo | Segment Selection"),
         ]
@@ -150,6 +413,25 @@ class BingoBoard:
 
     @classmethod
     def generate_rules(cls, nsegs=None, seed=None):
+        if nsegs is not None:
+            assert seed is not None, \
+                "Trying to inject URL into index, but no seed given."
+
+        html = cls._compile_rules(nsegs, seed is not None)
+        if seed is not None:
+            html = html.replace(_RULES_SEED_SLOT, str(seed))
+        return PreRenderedHtml(html)
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _compile_rules(cls, nsegs=None, with_seed=False):
+        """
+        Render the rules markdown once, with a placeholder standing in for
+        the seed so it can be substituted per request.
+        """
+        seed = _RULES_SEED_SLOT if with_seed else None
+        import markdown
+
         with open("BINGO_RULES.md") as rulefile:
             rules = rulefile.readlines()
 
@@ -157,9 +439,6 @@ class BingoBoard:
             rules.insert(1, f"Seed: {seed}\n")
 
         if nsegs is not None:
-            assert seed is not None, \
-                "Trying to inject URL into index, but no seed given."
-
             for _ in range(len(rules)):
                 line = rules.pop(0)
                 for seg_num in range(1, nsegs + 1):
@@ -170,7 +449,7 @@ class BingoBoard:
                 rules.append(line)
 
         rules = "".join(rules)
-        return PreRenderedHtml(markdown.markdown(rules))
+        return markdown.markdown(rules)
 
     def render_grid(self):
         return tags.Div(
@@ -229,22 +508,20 @@ class BingoBoard:
 
         return board_header
 
-    def render(self):
-        with open("bingo.css", "r") as css:
-            css_style = css.read()
-
-        with open("toggle.js", "r") as jsf:
-            js = jsf.read()
-
+    def render(self, pretty=True):
         head = [
             tags.Title([], "BC Bingo"),
-            tags.Style([], css_style),
-            tags.Script([], js),
+            tags.Link([
+                attributes.Rel("stylesheet"),
+                attributes.Href(ASSETS.url("bingo.css"))
+            ]),
+            tags.Script([attributes.Src(ASSETS.url("toggle.js"))]),
         ]
 
 
         header = tags.Div([attributes.Class("header")], [
-            self.generate_counter("miab", "incCounterMIAB", "/static/miab.png"),
+            self.generate_counter("miab", "incCounterMIAB",
+                                  ASSETS.url("miab.png")),
             tags.Div(
                 [attributes.Class("segment")],
                 tags.Div(
@@ -252,7 +529,8 @@ class BingoBoard:
                     self.create_header()
                 )
             ),
-            self.generate_counter("death", "incCounterDeaths", "/static/squish.png"),
+            self.generate_counter("death", "incCounterDeaths",
+                                  ASSETS.url("squish.png")),
         ])
 
         body = [
@@ -263,34 +541,111 @@ class BingoBoard:
         return tags.Html([],
                 tags.Head([], head),
                 tags.Body([], body),
-            ).render(pretty=True)
-
-import flask
-from flask import Flask
-app = Flask(__name__)
-
-@app.route("/", defaults={"seed": None})
-@app.route("/<seed>")
-def render_index(seed):
-    if seed is not None:
-        seed = int.from_bytes(str(seed).encode("utf8"), byteorder="big")
-    else:
-        seed = int(time.time())
+            ).render(pretty=pretty)
 
-    segments = {
-        int(f.replace(".csv", "").split("_")[-1]): f
-        for f in glob.glob("segments/segment_*.csv")
-    }
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def compile_page(cls, segment, ncols=5, nrows=5):
+        """
+        Render the page skeleton for a segment once, with placeholders for
+        the seed and squares, and split it into literal pieces and slots.
+        """
+        skel = cls(SegmentPool([]), seed=_SEED_SLOT, segment=segment,
+                   ncols=ncols, nrows=nrows)
+        skel._board = [[_CellSlot()] * nrows for _ in range(ncols)]
+        html = skel.render(pretty=False)
+        return re.split(f"({_SEED_SLOT}|{_CELL_SLOT})", html)
+
+    def render_compiled(self):
+        """
+        Equivalent to render() (up to whitespace), but joins the compiled
+        skeleton with the squares' pre-rendered HTML instead of building
+        and rendering a tag tree.
+        """
+        seed = str(self._seed)
+        # column major, same order as render_grid
+        cells = iter([sq.html for col in self._board for sq in col])
+        return "".join(
+            seed if piece == _SEED_SLOT
+            else next(cells) if piece == _CELL_SLOT
+            else piece
+            for piece in self.compile_page(self._seg, *self.size)
+        )
 
-    index = BingoBoard.generate_index(seed, len(segments))
-    return flask.render_template_string(index)
+# Number of distinct rendered boards kept in memory
+BOARD_CACHE_SIZE = 512
 
-@app.route("/segment/", defaults={"seed": None, "seg": "1"})
-@app.route("/segment/<seed>", defaults={"seed": None})
-@app.route("/segment/<seed>/<seg>")
-def render_board(seg, seed):
-    print(seed)
+@functools.lru_cache(maxsize=BOARD_CACHE_SIZE)
+def render_cached_board(seed, seg, version):
+    """
+    Render the board for a seed and segment, returning the HTML and its
+    ETag. Boards are fully determined by the seed and segment, so the
+    pool version is only part of the cache key.
+    """
     board = BingoBoard(f"segments/segment_{seg}.csv", seed=seed, segment=seg)
-    board.generate(int(seg))
+    board.generate(seg)
+    html = board.render_compiled()
+    return html, hashlib.sha1(html.encode("utf8")).hexdigest()
+
+def parse_spec(spec, limit=None, parse=None):
+    """
+    Parse a list like "1,3,10-20" (ranges inclusive) into a list of values.
+    Each entry, or number in a range, is converted with `parse`, by default
+    parse_seed. Raises ValueError if there would be more than `limit`
+    values, before expanding any ranges.
+    """
+    parse = parse or parse_seed
+    if isinstance(spec, (list, tuple)):
+        items = spec
+    else:
+        items = [item.strip() for item in str(spec).split(",") if item.strip()]
 
-    return flask.render_template_string(board.render())
+    ranges = []
+    for item in items:
+        start, sep, stop = str(item).partition("-")
+        if sep and start.isdigit() and stop.isdigit():
+            ranges.append(range(int(start), int(stop) + 1))
+        else:
+            ranges.append([item])
+
+    nvalues = sum(map(len, ranges))
+    if limit is not None and nvalues > limit:
+        raise ValueError(f"too many values ({nvalues} > {limit})")
+    return [parse(value) for values in ranges for value in values]
+
+def parse_seed(seed):
+    if seed is None:
+        return int(time.time())
+    if str(seed).isdigit():
+        return int(seed)
+    return int.from_bytes(str(seed).encode("utf8"), byteorder="big")
+
+def index_seed(name):
+    """
+    Seed of the index page at /<name>, where even numeric names are taken
+    as strings, so its boards differ from /segment/<name>/<n>.
+    """
+    return int.from_bytes(str(name).encode("utf8"), byteorder="big")
+
+def preload():
+    """
+    Load pools and assets and pre-render the rules, index, and page
+    skeletons, so that forked workers share them from the start.
+    """
+    POOLS.load_all()
+    ASSETS.load_all()
+
+    BingoBoard.generate_index(0, len(POOLS.segments))
+    for seg in POOLS.segments:
+        BingoBoard.compile_page(seg)
+
+def reload():
+    """
+    Drop everything loaded or rendered from disk and preload it again.
+    """
+    for cache in (render_cached_board, BingoBoard.compile_page,
+                  BingoBoard._compile_index, BingoBoard._compile_rules):
+        cache.cache_clear()
+    POOLS.clear()
+    ASSETS.clear()
+    preload()
@@ -0,0 +1,150 @@
+"""
+Bingo lines as bitmasks over the 25 board squares. Squares are numbered in
+the same (column major) order as on the board page, so square i is in
+column i // 5 and row i % 5. A board is kept as two masks, one for active
+(completed) squares and one for blocked squares, so checking lines is a
+few integer operations.
+"""
+NCOLS = NROWS = 5
+NSQUARES = NCOLS * NROWS
+
+def _mask(squares):
+    return sum(1 << (col * NROWS + row) for col, row in squares)
+
+LINE_MASKS = {
+    **{f"c{col + 1}": _mask((col, row) for row in range(NROWS))
+       for col in range(NCOLS)},
+    **{f"r{row + 1}": _mask((col, row) for col in range(NCOLS))
+       for row in range(NROWS)},
+    # upper left to lower right
+    "ul": _mask((i, i) for i in range(NCOLS)),
+    # lower left to upper right
+    "ll": _mask((i, NROWS - 1 - i) for i in range(NCOLS)),
+}
+
+def _compact(byte, offset):
+    # Every other bit of a byte, starting at offset, packed together
+    return sum(((byte >> (2 * i + offset)) & 1) << i for i in range(4))
+
+# Packed square states (2 bits per square, 1 = active, 2 = blocked) are
+# split a byte (four squares) at a time
+_ACTIVE_BITS = [_compact(byte, 0) for byte in range(256)]
+_BLOCKED_BITS = [_compact(byte, 1) for byte in range(256)]
+
+def split_packed(bits):
+    """
+    Convert a packed square state bitset into (active, blocked) masks.
+    """
+    active = blocked = 0
+    shift = 0
+    while bits:
+        byte = bits & 0xff
+        active |= _ACTIVE_BITS[byte] << shift
+        blocked |= _BLOCKED_BITS[byte] << shift
+        bits >>= 8
+        shift += 4
+    return active, blocked
+
+def to_masks(squares):
+    """
+    Convert a list of square states (0 inactive, 1 active, 2 blocked) into
+    (active, blocked) masks.
+    """
+    active = blocked = 0
+    for i, state in enumerate(squares):
+        if state == 1:
+            active |= 1 << i
+        elif state == 2:
+            blocked |= 1 << i
+    return active, blocked
+
+def completed_lines(active):
+    return [line for line, mask in LINE_MASKS.items()
+            if active & mask == mask]
+
+def possible_lines(blocked):
+    return [line for line, mask in LINE_MASKS.items()
+            if not blocked & mask]
+
+class BoardMask:
+    def __init__(self, active=0, blocked=0):
+        self.active = active
+        self.blocked = blocked
+
+    def update(self, squares):
+        """
+        Set the board from a list of square states, returning the lines
+        which were completed by this update.
+        """
+        before = set(self.completed())
+        self.active, self.blocked = to_masks(squares)
+        return [line for line in self.completed() if line not in before]
+
+    def completed(self):
+        return completed_lines(self.active)
+
+    def possible(self):
+        return possible_lines(self.blocked)
+
+def line_odds(active, blocked, prob=0.5, ntrials=200000, seed=None,
+              batch_size=50000):
+    """
+    Monte Carlo estimate of how likely each line is to complete, and to be
+    the first line completed, from the current board. Lines which are
+    already complete count as completing, but never as first. Lines
+    completing at the same time, e.g., a row and column finished by the
+    same square, share being first equally.
+
+    Each open square is completed by the end of the segment with
+    probability `prob` (a single value, or one per square), at a uniformly
+    random time. Active squares are already complete and blocked squares
+    never are. All lines are simulated at once, in batches of trials.
+
+    :return: {line: (chance of completing, chance of being first)}
+    """
+    import numpy
+
+    probs = numpy.array(numpy.broadcast_to(prob, (NSQUARES,)),
+                        dtype=numpy.float32)
+    squares = numpy.arange(NSQUARES)
+    is_active = (active >> squares) & 1 == 1
+    probs[is_active] = 1
+    probs[(blocked >> squares) & 1 == 1] = 0
+
+    # (line, square in line) -> square index
+    line_squares = numpy.array([
+        [i for i in range(NSQUARES) if (mask >> i) & 1]
+        for mask in LINE_MASKS.values()
+    ])
+    is_complete = numpy.array([active & mask == mask
+                               for mask in LINE_MASKS.values()])
+
+    rng = numpy.random.default_rng(seed)
+    completes = numpy.zeros(len(LINE_MASKS))
+    first = numpy.zeros(len(LINE_MASKS))
+    for start in range(0, ntrials, batch_size):
+        ntrial = min(batch_size, ntrials - start)
+
+        # A square completes if u < p, and given that, u / p is a uniform
+        # completion time
+        u = rng.random((ntrial, NSQUARES), dtype=numpy.float32)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            times = numpy.where(u < probs, u / probs, numpy.inf)
+        times[:, is_active] = 0
+
+        # A line is done when its last square is
+        line_times = times[:, line_squares].max(axis=2)
+        done = numpy.isfinite(line_times)
+        completes += done.sum(axis=0)
+
+        # Of the lines still open, those finishing first split the credit
+        line_times[:, is_complete] = numpy.inf
+        earliest = line_times.min(axis=1, keepdims=True)
+        winners = (line_times == earliest) & numpy.isfinite(earliest)
+        ntied = winners.sum(axis=1, keepdims=True)
+        first += (winners / numpy.maximum(ntied, 1)).sum(axis=0)
+
+    return {
+        line: (float(completes[i] / ntrials), float(first[i] / ntrials))
+        for i, line in enumerate(LINE_MASKS)
+    }
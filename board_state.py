@@ -0,0 +1,296 @@
+"""
+Server-side board state. Each (seed, segment, racer) keeps its squares as
+a packed bitset, two bits per square, plus the MiaB and death counters.
+State lives in a small SQLite file so that every server worker process
+sees the same, authoritative state.
+
+Anyone can read a board's state, but only its racer can change it: the
+first update of a board is given a secret token, which every later update
+has to pass.
+"""
+import os
+import hmac
+import queue
+import base64
+import hashlib
+import sqlite3
+import secrets
+import threading
+
+from bingo_lines import split_packed, completed_lines, possible_lines
+from sqlite_store import SQLiteStore
+
+# Square states, in the same order as toggle.js
+SQUARE_STATES = ["inactive", "active", "blocked"]
+NSQUARES = 25
+
+def pack_squares(states):
+    bits = 0
+    for i, state in enumerate(states):
+        bits |= (state & 3) << (2 * i)
+    return bits
+
+def unpack_squares(bits, nsquares=NSQUARES):
+    return [(bits >> (2 * i)) & 3 for i in range(nsquares)]
+
+def share_code(seed, segment, racer):
+    """
+    Short, stable code for a board, used in share links.
+    """
+    key = f"{seed}/{segment}/{racer}".encode("utf8")
+    digest = hashlib.blake2b(key, digest_size=6).digest()
+    return base64.urlsafe_b64encode(digest).decode("ascii")
+
+class BoardStateStore(SQLiteStore):
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS board_state (
+            seed TEXT NOT NULL,
+            segment INTEGER NOT NULL,
+            racer TEXT NOT NULL,
+            code TEXT NOT NULL UNIQUE,
+            squares INTEGER NOT NULL DEFAULT 0,
+            miab INTEGER NOT NULL DEFAULT 0,
+            deaths INTEGER NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 0,
+            token TEXT,
+            PRIMARY KEY (seed, segment, racer)
+        );
+        CREATE INDEX IF NOT EXISTS board_state_version
+            ON board_state (version);
+    """
+
+    def __init__(self, fname="board_state.db"):
+        super().__init__(fname)
+
+    def _setup(self, db):
+        try:
+            # From before boards had tokens
+            db.execute("ALTER TABLE board_state ADD COLUMN token TEXT")
+        except sqlite3.OperationalError:
+            pass
+
+    @staticmethod
+    def _to_dict(row):
+        seed, segment, racer, code, squares, miab, deaths, version = row
+        active, blocked = split_packed(squares)
+        return {
+            "seed": seed,
+            "segment": segment,
+            "racer": racer,
+            "code": code,
+            "squares": unpack_squares(squares),
+            "miab": miab,
+            "deaths": deaths,
+            "version": version,
+            "lines": completed_lines(active),
+            "possible": possible_lines(blocked),
+        }
+
+    _COLUMNS = "seed, segment, racer, code, squares, miab, deaths, version"
+
+    def get(self, seed, segment, racer):
+        row = self._db.execute(
+            f"SELECT {self._COLUMNS} FROM board_state "
+            f"WHERE seed = ? AND segment = ? AND racer = ?",
+            (str(seed), segment, racer)
+        ).fetchone()
+        if row is None:
+            return self._to_dict((str(seed), segment, racer,
+                                  share_code(seed, segment, racer),
+                                  0, 0, 0, 0))
+        return self._to_dict(row)
+
+    def resolve(self, code):
+        row = self._db.execute(
+            f"SELECT {self._COLUMNS} FROM board_state WHERE code = ?",
+            (code,)
+        ).fetchone()
+        return None if row is None else self._to_dict(row)
+
+    def get_all(self, seed, segment):
+        return [self._to_dict(row) for row in self._db.execute(
+            f"SELECT {self._COLUMNS} FROM board_state "
+            f"WHERE seed = ? AND segment = ?", (str(seed), segment)
+        )]
+
+    def latest_version(self):
+        version, = self._db.execute(
+            "SELECT COALESCE(MAX(version), 0) FROM board_state"
+        ).fetchone()
+        return version
+
+    def changed_since(self, version):
+        return [self._to_dict(row) for row in self._db.execute(
+            f"SELECT {self._COLUMNS} FROM board_state WHERE version > ? "
+            f"ORDER BY version", (version,)
+        )]
+
+    def update(self, seed, segment, racer, token=None, squares=None,
+               square=None, miab=None, deaths=None):
+        """
+        Update a board's state. `squares` replaces all square states,
+        `square` is an (index, state) pair for a single square. Returns the
+        new state, with the board's new token (as "token") if this was its
+        first update. Raises PermissionError if `token` isn't the board's.
+        """
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                "SELECT token FROM board_state "
+                "WHERE seed = ? AND segment = ? AND racer = ?",
+                (str(seed), segment, racer)
+            ).fetchone()
+            new_token = None
+            if row is None or row[0] is None:
+                token = new_token = secrets.token_urlsafe(16)
+            elif not hmac.compare_digest(row[0], token or ""):
+                raise PermissionError("Board belongs to another racer")
+
+            state = self.get(seed, segment, racer)
+            bits = pack_squares(state["squares"])
+            if squares is not None:
+                bits = pack_squares(squares)
+            if square is not None:
+                idx, value = square
+                bits = bits & ~(3 << (2 * idx)) | ((value & 3) << (2 * idx))
+
+            version, = db.execute(
+                "SELECT COALESCE(MAX(version), 0) + 1 FROM board_state"
+            ).fetchone()
+            db.execute(
+                f"INSERT OR REPLACE INTO board_state ({self._COLUMNS}, token) "
+                f"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (str(seed), segment, racer, state["code"], bits,
+                 state["miab"] if miab is None else miab,
+                 state["deaths"] if deaths is None else deaths,
+                 version, token)
+            )
+            db.execute("COMMIT")
+        except:
+            db.execute("ROLLBACK")
+            raise
+
+        state = self.get(seed, segment, racer)
+        if new_token is not None:
+            state["token"] = new_token
+        return state
+
+def state_diff(old, new):
+    """
+    Fields of `new` which differ from `old`, squares as {index: state}. With
+    no `old` state, everything is included.
+    """
+    diff = {"racer": new["racer"], "version": new["version"]}
+    old_squares = old["squares"] if old else [None] * len(new["squares"])
+    squares = {i: sq for i, (prev, sq)
+               in enumerate(zip(old_squares, new["squares"])) if prev != sq}
+    if squares:
+        diff["squares"] = squares
+    for field in ("miab", "deaths", "lines", "possible"):
+        if old is None or old[field] != new[field]:
+            diff[field] = new[field]
+    return diff
+
+class StateBroker:
+    """
+    Fans out board state changes to subscribers of a (seed, segment). A
+    single thread per process watches the store for new versions (so
+    changes made by other worker processes are seen too) and pushes diffs
+    onto each subscriber's queue. Idle subscribers just block on their
+    queue, and the store isn't queried while there are none.
+    """
+    # Sent to subscribers when the broker is shutting down
+    CLOSED = None
+    _EMPTY = {"squares": [0] * NSQUARES, "miab": 0, "deaths": 0,
+              "lines": [], "possible": possible_lines(0)}
+
+    def __init__(self, store, interval=0.25):
+        self.store = store
+        self.interval = interval
+
+        self._subs = {}
+        self._last = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+
+    def _ensure_running(self):
+        # Threads don't survive a fork, each worker needs its own
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._version = self.store.latest_version()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def subscribe(self, seed, segment):
+        subscriber = queue.SimpleQueue()
+        key = (str(seed), segment)
+        with self._lock:
+            self._ensure_running()
+            if not self._subs:
+                # Changes made while nobody was listening aren't sent, so
+                # don't go through them all on the next check
+                self._version = self.store.latest_version()
+            if key not in self._subs:
+                # so the first change is sent as a diff, not a full state
+                for state in self.store.get_all(seed, segment):
+                    self._last[(*key, state["racer"])] = state
+            self._subs.setdefault(key, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, seed, segment, subscriber):
+        key = (str(seed), segment)
+        with self._lock:
+            subs = self._subs.get(key, set())
+            subs.discard(subscriber)
+            if not subs:
+                self._subs.pop(key, None)
+                self._last = {k: v for k, v in self._last.items()
+                              if k[:2] != key}
+
+    def notify(self):
+        """
+        Check for changes now, rather than at the next interval.
+        """
+        self._wake.set()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for subs in self._subs.values():
+                for subscriber in subs:
+                    subscriber.put(self.CLOSED)
+
+    def publish(self, changes):
+        with self._lock:
+            for state in changes:
+                key = (state["seed"], state["segment"])
+                subs = self._subs.get(key)
+                if not subs:
+                    continue
+
+                full_key = (*key, state["racer"])
+                # Boards not seen at subscription time are new, i.e., empty
+                diff = state_diff(self._last.get(full_key, self._EMPTY),
+                                  state)
+                self._last[full_key] = state
+                if diff.keys() <= {"racer", "version"}:
+                    # e.g., a change undone before it was seen
+                    continue
+                for subscriber in subs:
+                    subscriber.put(diff)
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if not self._subs:
+                continue
+
+            changes = self.store.changed_since(self._version)
+            if changes:
+                self._version = changes[-1]["version"]
+                self.publish(changes)
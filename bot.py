@@ -1,14 +1,26 @@
 import sys
 import os
+import bisect
+import asyncio
 import json
+import contextlib
 import datetime
 import csv
+import time
 import random
 import pathlib
+from collections.abc import MutableMapping
 
+import aiohttp
 from twitchio.ext import commands, routines
 
-from bc_bingo import __version__
+from _version import __version__
+from bingo_lines import LINE_MASKS, BoardMask, line_odds
+from journal import Journal
+from game_store import GameStore
+from deadlines import DeadlineScheduler
+from chat_queue import ChatQueue, URGENT, NORMAL, join_chunks
+from metrics import METRICS, CONTENT_TYPE
 
 import logging
 logging.basicConfig(level=logging.INFO)
@@ -16,21 +28,37 @@ log = logging.getLogger(__name__)
 
 _DOC_BASE = "https://github.com/fusoyeahhh/beyond_chaos_bingo/blob/main/BINGO_RULES.md"
 
-def format_scoreboard(points, max_len=300):
-    chunks = [
-        f"@{k}: {v}"
-        for k, v in sorted(points.items(), key=lambda t: -t[1])
-    ]
-
-    if len(chunks) == 0:
-        yield "No scores yet."
-        return
-
-    while len(chunks) > 0:
-        out = [chunks.pop(0)]
-        while len(chunks) > 0 and sum(map(len, out)) < max_len:
-            out.append(chunks.pop(0))
-        yield " | ".join(out)
+MESSAGES = METRICS.counter("bcbingo_bot_messages_total",
+                           "Chat messages received.")
+DROPPED = METRICS.counter("bcbingo_bot_dropped_requests_total",
+                          "Commands dropped as repeated too quickly.",
+                          ["command"])
+COMMAND_SECONDS = METRICS.histogram("bcbingo_bot_command_seconds",
+                                    "Time handling commands.", ["command"])
+GUESSES = METRICS.counter("bcbingo_bot_guesses_total",
+                          "Guesses accepted.", ["gtype"])
+WINNERS_SECONDS = METRICS.histogram("bcbingo_bot_winners_seconds",
+                                    "Time finding guess winners.")
+PERSIST_SECONDS = METRICS.histogram("bcbingo_bot_persist_seconds",
+                                    "Time persisting state, by step.",
+                                    ["step"])
+
+@contextlib.contextmanager
+def atomic_open(fname):
+    """
+    Write to a temporary file and move it into place, so a crash never
+    leaves a partly written file behind.
+    """
+    tmp = f"{fname}.tmp"
+    with open(tmp, "w", newline="") as fout:
+        yield fout
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp, fname)
+
+def write_csv(fname, rows):
+    with atomic_open(fname) as csvfile:
+        csv.writer(csvfile, delimiter=",").writerows(rows)
 
 def determine_overall_winner(points):
     high_score = max(max(points.values()), 1)
@@ -38,23 +66,70 @@ def determine_overall_winner(points):
     winner = None if len(winner) == 0 else " and ".join(winner)
     return winner
 
-def closest_not_over(guesses, value):
-    ordered = {k: value - v for k, v in guesses.items() if value - v >= 0}
-    log.debug(str(guesses))
-    log.debug(str((value, str(ordered))))
-    if len(ordered) == 0:
-        return set()
-    closest = sorted(ordered.values())[0]
-    return {k for k, v in ordered.items() if v == closest}
+class Leaderboard(MutableMapping):
+    """
+    Points per player, also kept ranked (highest first, then by name) as
+    they change, so scoreboard pages and ranks need no sorting. Rendered
+    scoreboard pages are cached until points change.
+    """
+    def __init__(self, points=None, max_len=300):
+        self.max_len = max_len
+        self._points = {}
+        self._ranked = []
+        self._pages = None
+        self.update(points or {})
+
+    def __getitem__(self, name):
+        return self._points[name]
+
+    def __setitem__(self, name, points):
+        if name in self._points:
+            if self._points[name] == points:
+                return
+            self._unrank(name)
+        self._points[name] = points
+        bisect.insort(self._ranked, (-points, name))
+        self._pages = None
+
+    def __delitem__(self, name):
+        self._unrank(name)
+        del self._points[name]
+        self._pages = None
+
+    def __iter__(self):
+        return iter(self._points)
+
+    def __len__(self):
+        return len(self._points)
+
+    def __repr__(self):
+        return f"Leaderboard({self._points!r})"
+
+    def _unrank(self, name):
+        del self._ranked[bisect.bisect_left(self._ranked,
+                                            (-self._points[name], name))]
+
+    def rank(self, name):
+        """
+        A player's rank, starting at 1. Players with equal points share a
+        rank.
+        """
+        return bisect.bisect_left(self._ranked, (-self._points[name],)) + 1
+
+    def pages(self):
+        if self._pages is None:
+            self._pages = list(join_chunks(
+                (f"@{name}: {-points}" for points, name in self._ranked),
+                " | ", self.max_len
+            )) or ["No scores yet."]
+        return self._pages
 
 class PlayerSet:
     VALID_GUESS_TYPES = ["bingo", "miab", "deaths", "kefkadeath"]
+    # Guess types won by the closest guess not over the final count
+    COUNT_GUESS_TYPES = ["miab", "deaths"]
 
-    ALLOWED_BINGO_GUESSES = sorted({
-        *[f"c{i}" for i in range(1, 6)],
-        *[f"r{i}" for i in range(1, 6)],
-        "ll", "ul"
-    })
+    ALLOWED_BINGO_GUESSES = sorted(LINE_MASKS)
     @classmethod
     def validate_guess(cls, guess):
         return guess.strip().lower() in cls.ALLOWED_BINGO_GUESSES
@@ -79,6 +154,11 @@ class PlayerSet:
         self._store = {}
         self._overwrite = overwrite
 
+        # The players who guessed each value, and for count guesses, the
+        # distinct guessed values in sorted order
+        self._by_value = {gtype: {} for gtype in self.VALID_GUESS_TYPES}
+        self._values = {gtype: [] for gtype in self.COUNT_GUESS_TYPES}
+
     def __len__(self):
         return len(self._store)
 
@@ -90,39 +170,51 @@ class PlayerSet:
     def overwrite(self, value):
         self._overwrite = bool(value)
 
+    def snapshot(self):
+        """
+        Copy of every player's guesses, for writing out elsewhere.
+        """
+        return {name: dict(pstore) for name, pstore in self._store.items()}
+
+    @classmethod
+    def csv_rows(cls, store, game_state=None):
+        if game_state is not None:
+            yield game_state
+
+        for name, pstore in store.items():
+            yield (
+                name,
+                *[str(pstore.get(k, "")) for k in cls.VALID_GUESS_TYPES]
+            )
+
     def to_csv(self, fname, game_state=None):
-        with open(fname, "w", newline="") as csvfile:
-            statewriter = csv.writer(csvfile, delimiter=",")
-            if game_state is not None:
-                statewriter.writerow(game_state)
-
-            for name, pstore in self._store.items():
-                row = (
-                    name,
-                    *[str(pstore.get(k, "")) for k in self.VALID_GUESS_TYPES]
-                )
-                statewriter.writerow(row)
+        write_csv(fname, self.csv_rows(self._store, game_state))
 
+    @WINNERS_SECONDS.timed()
     def get_winners(self, gtype, value):
         if gtype not in self.VALID_GUESS_TYPES:
             raise ValueError(f"Invalid guess type: {gtype}")
 
-        if len(self._store) == 0:
-            return set()
-
-        if gtype == "bingo":
-            winners = {
-                name for name, pstore in self._store.items()
-                if pstore.get(gtype, None) == value
-            }
+        if gtype not in self.COUNT_GUESS_TYPES:
+            winners = set(self._by_value[gtype].get(value, ()))
         else:
-            winners = closest_not_over({
-                k: pstore[gtype]
-                for k, pstore in self._store.items()
-                if gtype in pstore
-            }, int(value))
+            # Closest guess not over the value is the largest one <= value
+            values = self._values[gtype]
+            idx = bisect.bisect_right(values, int(value))
+            if idx == 0:
+                return set()
+            winners = set(self._by_value[gtype][values[idx - 1]])
         return winners
 
+    def counts(self, gtype):
+        """
+        Number of players who guessed each value, e.g. per bingo line.
+        """
+        if gtype not in self.VALID_GUESS_TYPES:
+            raise ValueError(f"Invalid guess type: {gtype}")
+        return {value: len(players)
+                for value, players in self._by_value[gtype].items()}
+
     def __getitem__(self, value):
         return self._store[value]
 
@@ -130,7 +222,31 @@ class PlayerSet:
         if name not in self._store:
             self._store[name] = {}
 
-    def guess(self, name, gtype, value):
+    def _index(self, name, gtype, value):
+        players = self._by_value[gtype].get(value)
+        if players is None:
+            if gtype in self._values:
+                bisect.insort(self._values[gtype], value)
+            players = self._by_value[gtype][value] = set()
+        players.add(name)
+
+    def _unindex(self, name, gtype, value):
+        players = self._by_value[gtype][value]
+        players.discard(name)
+        if not players:
+            del self._by_value[gtype][value]
+            if gtype in self._values:
+                values = self._values[gtype]
+                del values[bisect.bisect_left(values, value)]
+
+    def remove(self, name):
+        """
+        Drop a player and all of their guesses.
+        """
+        for gtype, value in self._store.pop(name, {}).items():
+            self._unindex(name, gtype, value)
+
+    def guess(self, name, gtype, value, force=False):
         if gtype not in self.VALID_GUESS_TYPES:
             raise ValueError(f"Invalid guess type: {gtype}")
 
@@ -138,16 +254,55 @@ class PlayerSet:
 
         pstore = self._store[name]
         if value is None:
-            pstore.pop(value, None)
+            if gtype in pstore:
+                self._unindex(name, gtype, pstore.pop(gtype))
             return True
 
-        if gtype not in pstore or self.overwrite:
+        if gtype not in pstore or self.overwrite or force:
+            if gtype in pstore:
+                self._unindex(name, gtype, pstore[gtype])
             pstore[gtype] = value
+            self._index(name, gtype, value)
             return True
 
         return False
 
 
+class RequestFilter:
+    """
+    Drops chat commands repeated too quickly: the same command from the
+    same user within `cooldown` seconds, and the same request within
+    `window` seconds. Requests in `shared` get the same reply whoever asks,
+    so they are dropped if anyone made them recently.
+    """
+    # Expired entries are cleared out once there are this many
+    _PRUNE_AT = 10000
+
+    def __init__(self, cooldown=2.0, window=10.0, shared=()):
+        self.cooldown = cooldown
+        self.window = window
+        self.shared = set(shared)
+        self._until = {}
+        self._prune_at = self._PRUNE_AT
+
+    def allow(self, user, command, request, now=None):
+        now = time.monotonic() if now is None else now
+        owner = None if request in self.shared else user
+        keys = {("cooldown", user, command): self.cooldown,
+                ("request", owner, request): self.window}
+        if any(self._until.get(key, 0) > now for key in keys):
+            return False
+
+        if len(self._until) >= self._prune_at:
+            self._until = {k: t for k, t in self._until.items() if t > now}
+            # With many entries still active, don't prune again until there
+            # are twice as many, so pruning stays cheap per message
+            self._prune_at = max(self._PRUNE_AT, 2 * len(self._until))
+        for key, wait in keys.items():
+            self._until[key] = now + wait
+        return True
+
+
 class AuthorizedCommand(commands.Command):
     _AUTHORIZED = set()
 
@@ -156,7 +311,7 @@ class AuthorizedCommand(commands.Command):
         if self._authenticate(user):
             return await super().invoke(ctx, index=index)
 
-        await ctx.send(f"I'm sorry, @{user}, I can't do that...")
+        ctx.bot.say(ctx, f"I'm sorry, @{user}, I can't do that...")
         return
 
     def _authenticate(self, user):
@@ -181,6 +336,11 @@ class BCBingoBot(commands.Bot):
         "kefkadeath": -8
     }
     GUESS_WINDOW = 60 * 10
+    # Announce the time left this many seconds before guesses close
+    GUESS_REMINDERS = [300, 120, 60]
+    # Requests with the same reply for everyone
+    SHARED_REQUESTS = ["bcb current", "bcb odds", "scoreboard",
+                       "scoreboard all", "hi", "bcbingo", "help"]
 
     def __init__(self, config, segment=1, restore_from=None):
         log.info(f"Initializing bot, BC Bingo version {__version__}")
@@ -190,14 +350,32 @@ class BCBingoBot(commands.Bot):
         log.info(f"Configuration:\n{self._cfg}")
 
         super().__init__(**self._cfg)
-        self.reset()
         self._segment = segment
+        self.reset()
 
-        self._timer = None
-        self._points = self.load_points(self._points_file)
+        if self._database is not None:
+            self._points = Leaderboard(self._database.points())
+        else:
+            self._points = Leaderboard(self.load_points(self._points_file))
+        # The first board fetch only syncs up, lines already complete
+        # then may have been awarded before a restart
+        self._board_synced = False
+        self._http = None
 
         if restore_from is not None:
            self.restore(restore_from)
+        elif self._database is not None:
+            self.resume()
+
+        if self._journal is not None:
+            # Guesses and counters are only carried over when restoring,
+            # points always are
+            self.replay(self._journal.fname, points_only=restore_from is None)
+            self.serialize()
+
+        # Nothing has happened yet, the database is up to date
+        self._db_pending = []
+        self._saved_changes = self._changes
 
     def load_config(self, config):
         with open(config, "r") as fin:
@@ -216,6 +394,69 @@ class BCBingoBot(commands.Bot):
 
         self._tracking = opts.pop("tracking_file", None)
         self._points_file = opts.pop("points_file", None)
+
+        # Journal changes between (less frequent) full snapshots
+        self._journal = None
+        journal = opts.pop("journal_file", None)
+        self._compact_every = opts.pop("journal_compact_every", 10000)
+        if journal is not None:
+            if self._tracking is None or self._points_file is None:
+                log.error("Journaling needs both tracking_file and "
+                          "points_file for snapshots, not journaling.")
+            else:
+                self._journal = Journal(journal)
+        # Guesses, points and counts per seed, in a SQLite database
+        self._database = None
+        if "database" in opts:
+            self._database = GameStore(opts.pop("database"),
+                                       opts.pop("seed", "default"))
+        self._db_pending = []
+
+        # Outbound chat, Twitch allows 20 messages per 30 seconds (100 for
+        # moderators)
+        self._chat = ChatQueue(limit=opts.pop("chat_rate", 20), period=30,
+                               ack_window=opts.pop("chat_ack_window", 1.0))
+
+        # Guess windows and other timers, keyed by "<channel>/<category>"
+        self._deadlines = DeadlineScheduler(
+            self._deadline_passed, self._deadline_reminder,
+            reminders=opts.pop("guess_reminders", self.GUESS_REMINDERS)
+        )
+        self._save_interval = opts.pop("save_interval", 10)
+
+        # Throttling of repeated commands, admins are exempt
+        self._requests = RequestFilter(
+            cooldown=opts.pop("command_cooldown", 2.0),
+            window=opts.pop("duplicate_window", 10.0),
+            shared=self.SHARED_REQUESTS
+        )
+
+        # Local HTTP endpoint for metrics, off unless a port is given
+        self._metrics_port = opts.pop("metrics_port", None)
+        self._metrics_runner = None
+        if self._metrics_port is not None:
+            METRICS.enable()
+            METRICS.gauge("bcbingo_bot_chat_queue_depth",
+                          "Chat messages waiting to be sent.",
+                          lambda: len(self._chat))
+            METRICS.gauge("bcbingo_bot_players", "Players with guesses.",
+                          lambda: len(self._pstate))
+
+        self._recorded_game = None
+        # Changes recorded, and how many of them were saved
+        self._changes = self._saved_changes = 0
+        self._saving = None
+        self._save_again = False
+
+        # Board state to watch for completed lines, e.g.,
+        # http://127.0.0.1:5000/api/state/<seed>/{segment}/<racer>
+        self._board_url = opts.pop("board_url", None)
+        # Award points for detected lines, or only ask admins to confirm
+        # them with !bingoline
+        self._auto_award = opts.pop("auto_award_lines", True)
+        # Chance any open square gets completed, used for line odds
+        self._odds_prob = opts.pop("odds_square_prob", 0.5)
+        self._odds_trials = opts.pop("odds_trials", 200000)
         return opts
 
     def _get_streamer(self):
@@ -240,13 +481,10 @@ class BCBingoBot(commands.Bot):
 
         return pts
 
-    def save_points(self, fname):
-        fname = pathlib.Path(fname)
-        with open(fname, 'w', newline='') as csvfile:
-            ptwriter = csv.writer(csvfile, delimiter=",")
-            for user, pts in self._points.items():
-                if user is not None:
-                    ptwriter.writerow((user, str(pts)))
+    def save_points(self, fname, points=None):
+        points = self._points if points is None else points
+        write_csv(fname, ((user, str(pts)) for user, pts in points.items()
+                          if user is not None))
 
     def assign_points(self, gtype, value):
         if gtype == "kefkadeath":
@@ -257,6 +495,8 @@ class BCBingoBot(commands.Bot):
         for winner in winners:
             ptval = self._points.get(winner, 0) + self._POINTS_FOR[gtype]
             self._points[winner] = ptval
+            self._record("points", name=winner, points=ptval,
+                         gtype=gtype, value=value)
             log.info(f"{winner} now has {ptval} points")
 
         return winners
@@ -279,74 +519,407 @@ class BCBingoBot(commands.Bot):
 
     def restore(self, restore_from):
         self._pstate = PlayerSet.from_csv(restore_from)
-        gstate = self._pstate._store.pop("_", {})
+        gstate = self._pstate._store.get("_", {})
+        self._pstate.remove("_")
         self.miab = int(gstate.get("miab", 0))
         self.deaths = int(gstate.get("deaths", 0))
         self._segment = int(gstate.get("bingo", 1))
 
+        timers = pathlib.Path(self._timers_file(restore_from))
+        if timers.exists():
+            for key, deadline in json.loads(timers.read_text()).items():
+                self._set_deadline(key, deadline)
+
         log.info(f"Starting from segment {self._segment} with "
                  f"{len(self._pstate)} players.")
 
-    def serialize(self):
+    @staticmethod
+    def _timers_file(tracking):
+        return f"{tracking}.timers.json"
+
+    @PERSIST_SECONDS.timed("snapshot")
+    def _snapshot(self):
+        # Cheap copies, taken on the event loop
+        game_state = ("_", *map(str, self._game_state()))
+        snapshot = (game_state, self._pstate.snapshot(), dict(self._points),
+                    self._deadlines.deadlines(), self._changes)
+        if self._journal is not None:
+            # Everything journaled so far is in the snapshot
+            self._record_game()
+            self._journal.rotate()
+        return snapshot
+
+    @PERSIST_SECONDS.timed("write")
+    def _write_snapshot(self, snapshot):
+        """
+        Write a snapshot out, returning the number of changes it holds.
+        """
+        game_state, store, points, deadlines, changes = snapshot
         if self._tracking is not None:
             log.debug(f"Serializing state to {self._tracking}")
-            game_state = ("_", *map(str, (self._segment, self.miab, self.deaths)))
-            self._pstate.to_csv(self._tracking, game_state=game_state)
+            write_csv(self._tracking, PlayerSet.csv_rows(store, game_state))
+            with atomic_open(self._timers_file(self._tracking)) as fout:
+                json.dump(deadlines, fout)
 
         if self._points_file is not None:
             log.debug(f"Serializing points to {self._points_file}")
-            self.save_points(self._points_file)
+            self.save_points(self._points_file, points)
+
+        if self._journal is not None:
+            self._journal.discard_rotated()
+        return changes
+
+    def serialize(self):
+        """
+        Write the state out now, blocking. See `save` for the event loop.
+        """
+        self._saved_changes = self._write_snapshot(self._snapshot())
+
+    def save(self):
+        """
+        Write the state out from a background thread, returning a future
+        for the write. Only one write is in flight at a time; saves asked
+        for during a write are coalesced into one more write, of the state
+        as it is when that write starts.
+        """
+        if self._saving is not None and not self._saving.done():
+            self._save_again = True
+            return self._saving
+
+        self._save_again = False
+        self._saving = asyncio.ensure_future(self._save(self._snapshot()))
+        return self._saving
+
+    async def _save(self, snapshot):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                # Only counted as saved once written, so a failed write is
+                # retried on the next save_loop
+                self._saved_changes = await loop.run_in_executor(
+                    None, self._write_snapshot, snapshot
+                )
+            except Exception as e:
+                log.error(f"Encountered error while serializing game "
+                          f"state: {e}")
+
+            if not self._save_again:
+                return
+            self._save_again = False
+            snapshot = self._snapshot()
+
+    def _game_state(self):
+        return (self._segment, self.miab, self.deaths)
+
+    def _record(self, kind, **fields):
+        """
+        Journal a state change and queue it for the database, if either is
+        in use.
+        """
+        self._changes += 1
+        if self._journal is not None:
+            self._journal.append(kind, **fields)
+        if self._database is not None:
+            self._db_pending.append({"kind": kind, "segment": self._segment,
+                                     **fields})
+
+    def _record_game(self):
+        if self._game_state() != self._recorded_game:
+            self._recorded_game = self._game_state()
+            self._record("game", segment=self._segment, miab=self.miab,
+                         deaths=self.deaths)
+
+    def _guess(self, user, gtype, value):
+        result = self._pstate.guess(user, gtype, value)
+        if result:
+            self._record("guess", name=user, gtype=gtype, value=value)
+            # Only guesses from chat, not ones restored or replayed
+            if value is not None:
+                GUESSES.inc(gtype)
+        return result
+
+    @PERSIST_SECONDS.timed("journal")
+    def flush_journal(self):
+        """
+        Write out journaled changes, and snapshot once the journal gets
+        long. Nothing is written if nothing changed.
+        """
+        self._journal.flush()
+        if len(self._journal) >= self._compact_every:
+            log.info(f"Compacting journal {self._journal.fname}")
+            self.save()
+
+    @PERSIST_SECONDS.timed("database")
+    async def flush_database(self):
+        """
+        Write queued changes to the database in one transaction, from a
+        background thread.
+        """
+        entries, self._db_pending = self._db_pending, []
+        if entries:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._database.apply, entries
+            )
+
+    def resume(self):
+        """
+        Pick up the latest segment of the seed from the database.
+        """
+        segment = self._database.latest_segment()
+        if segment is None:
+            return
+
+        self._segment = segment
+        self.miab, self.deaths = self._database.counts(segment)
+        for name, gtype, value in self._database.guesses(segment):
+            self._pstate.guess(name, gtype, value, force=True)
+        self._recorded_game = self._game_state()
+
+        log.info(f"Resuming segment {self._segment} with "
+                 f"{len(self._pstate)} players from the database.")
+
+    def replay(self, fname, points_only=False):
+        """
+        Apply journaled changes on top of the current state.
+        """
+        # Replayed changes are already journaled
+        journal, self._journal = self._journal, None
+        database, self._database = self._database, None
+        try:
+            for entry in Journal.replay(fname):
+                kind = entry["kind"]
+                if kind == "points":
+                    self._points[entry["name"]] = entry["points"]
+                elif points_only:
+                    continue
+                elif kind == "guess":
+                    self._pstate.guess(entry["name"], entry["gtype"],
+                                       entry["value"], force=True)
+                elif kind == "game":
+                    self._segment = entry["segment"]
+                    self.miab = entry["miab"]
+                    self.deaths = entry["deaths"]
+                elif kind == "reset":
+                    self.reset()
+                elif kind == "timer":
+                    self._set_deadline(entry["key"], entry["deadline"])
+        finally:
+            self._journal = journal
+            self._database = database
 
     def reset(self):
+        self._record("reset")
         self._pstate = PlayerSet()
         self._toggle = False
+        for key in self._deadlines.deadlines():
+            if key.endswith("/guesses"):
+                self._deadlines.cancel(key)
         self._miab = 0
         self._deaths = 0
+        self._board = BoardMask()
+        # Lines awarded, or detected and waiting for an admin to confirm
+        self._lines_announced = set()
+
+    def say(self, target, msg, priority=NORMAL):
+        """
+        Queue a chat message to a channel or command context.
+        """
+        self._chat.send(target, msg, priority)
+
+    def announce(self, target, msg):
+        """
+        Queue an admin or results message, ahead of everything else.
+        """
+        self._chat.send(target, msg, URGENT)
+
+    def ack_guess(self, ctx, user, value):
+        # Acknowledgements are combined, hundreds can arrive at once
+        self._chat.ack(ctx.channel, f"@{user} {value}",
+                       prefix="guesses recorded: ")
+
+    def _channel(self, name):
+        return self.get_channel(name) or self.connected_channels[0]
+
+    def _set_deadline(self, key, deadline):
+        """
+        Set (or with None, cancel) a deadline without recording it.
+        """
+        if deadline is None:
+            self._deadlines.cancel(key)
+            return
+        self._deadlines.set(key, deadline)
+        if key.endswith("/guesses"):
+            # Guesses are open until the deadline
+            self._toggle = True
+
+    def _deadline_passed(self, key):
+        self._record("timer", key=key, deadline=None)
+        channel, category = key.rsplit("/", 1)
+        if category == "guesses":
+            log.info("Closing guesses.")
+            self._toggle = False
+            self.announce(self._channel(channel),
+                          f"Guesses for {self._segment} are now CLOSED.")
+
+    def _deadline_reminder(self, key, remaining):
+        channel, category = key.rsplit("/", 1)
+        if category == "guesses":
+            self.announce(self._channel(channel),
+                          f"About {round(remaining / 60)} minutes left for "
+                          f"segment {self._segment} guesses.")
+
+    async def award_lines(self, lines):
+        """
+        Assign points for completed bingo lines, once per line per segment.
+        With auto_award_lines off, admins are asked to confirm them with
+        !bingoline instead.
+        """
+        chan = self.connected_channels[0]
+        for line in lines:
+            if line in self._lines_announced:
+                continue
+            self._lines_announced.add(line)
+
+            if not self._auto_award:
+                self.announce(chan, f"The board shows {line} completed. "
+                                    f"Admins, confirm with !bingoline {line}")
+                continue
+
+            winners = ", ".join("@" + w for w in self.assign_points("bingo", line))
+            self.announce(chan, f"C H A O S ACHIEVED. Winners for {line}: {winners}")
 
     #
     # Twitch integration
     #
     @routines.routine(seconds=10)
-    async def core_loop(self):
-        # core interaction
-
-        if self._timer is not None:
-            chan = self.connected_channels[0]
-            # FIXME: need to keep this in sync with the routine interval
-            self._timer -= 10
-            if self._timer <= 0:
-                self._timer = None
-                log.info("Firing timer event.")
-                self._toggle = False
-                await chan.send(f"Guesses for {self._segment} are now CLOSED.")
-            elif self._timer // 5 in list(range(1, 59, 5)):
-                min_left = self._timer // 60
-                await chan.send(f"About {min_left} minutes left for segment {self._segment} guesses.")
+    async def save_loop(self):
+        # Only used without a journal, and only if something changed
+        self._record_game()
+        if self._changes == self._saved_changes:
+            return
 
         try:
             log.debug("Doin' a thing...")
-            self.serialize()
+            self.save()
         except Exception as e:
             log.error("Encountered error while monitoring game state.")
             log.error(str(e))
 
+    @routines.routine(seconds=1)
+    async def persist_loop(self):
+        try:
+            self._record_game()
+            if self._journal is not None:
+                self.flush_journal()
+            if self._database is not None:
+                await self.flush_database()
+        except Exception as e:
+            log.error(f"Encountered error while persisting game state: {e}")
+
+    @routines.routine(seconds=2)
+    async def board_loop(self):
+        url = self._board_url.format(segment=self._segment)
+        try:
+            async with self._http.get(url) as resp:
+                resp.raise_for_status()
+                state = await resp.json()
+        except (aiohttp.ClientError, ValueError) as e:
+            log.error(f"Couldn't fetch board state from {url}: {e}")
+            return
+
+        lines = self._board.update(state["squares"])
+        if not self._board_synced:
+            self._board_synced = True
+            self._lines_announced |= set(self._board.completed())
+            return
+
+        if lines:
+            log.info(f"Detected completed lines: {', '.join(lines)}")
+            await self.award_lines(lines)
+
     async def event_ready(self):
         log.warning("HELLO HUMAN, I AM CHAOS INCARNATE "
                     "WITH A BINGO PROBLEM, LET'S DO THIS THING.")
-        self.core_loop.start()
+        self._chat.start()
+        self._deadlines.arm()
+        if self._journal is None:
+            self.save_loop.change_interval(seconds=self._save_interval)
+            self.save_loop.start()
+        if self._journal is not None or self._database is not None:
+            self.persist_loop.start()
+        if self._board_url is not None:
+            self._http = aiohttp.ClientSession()
+            self.board_loop.start()
+        if self._metrics_port is not None:
+            await self.serve_metrics()
+
+    async def serve_metrics(self):
+        """
+        Serve metrics in the Prometheus text format, on localhost.
+        """
+        from aiohttp import web
+
+        async def metrics(request):
+            return web.Response(body=METRICS.render().encode("utf8"),
+                                headers={"Content-Type": CONTENT_TYPE})
+
+        app = web.Application()
+        app.router.add_get("/metrics", metrics)
+        self._metrics_runner = web.AppRunner(app)
+        await self._metrics_runner.setup()
+        await web.TCPSite(self._metrics_runner, "127.0.0.1",
+                          self._metrics_port).start()
+        log.info(f"Serving metrics on http://127.0.0.1:{self._metrics_port}/metrics")
 
     async def event_message(self, msg):
         if msg.echo:
             return
+        MESSAGES.inc()
 
-        await self.handle_commands(msg)
+        # Most of chat isn't commands, don't bother parsing it
+        prefix = self._cfg["prefix"]
+        if not msg.content.startswith(prefix):
+            return
+
+        request = msg.content[len(prefix):].split()
+        command = self.get_command(request[0]) if request else None
+        if command is None:
+            return
+
+        user = msg.author.name
+        if user not in AuthorizedCommand._AUTHORIZED:
+            request = " ".join(request).lower()
+            if not self._requests.allow(user, command.name, request):
+                log.debug(f"Dropping repeated request from {user}: {request}")
+                DROPPED.inc(command.name)
+                return
+
+        with COMMAND_SECONDS.time(command.name):
+            await self.handle_commands(msg)
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.close()
+        self._record_game()
+        if self._journal is not None:
+            self.flush_journal()
+        if self._database is not None:
+            await self.flush_database()
+        if self._saving is not None:
+            await self._saving
+        if self._journal is not None:
+            self._journal.close()
+        await self._chat.close()
+        if self._metrics_runner is not None:
+            await self._metrics_runner.cleanup()
+        await super().close()
 
     #
     # Generic commands
     #
     @commands.command(name='hi')
     async def hi(self, ctx):
-        await ctx.send("/me Hi. I'm BC Bingo Bot. "
+        self.say(ctx, "/me Hi. I'm BC Bingo Bot. "
                        "Welcome to Beyond Chaos Bingo "
                        "where the points don't matter and "
                        "the game over square is probably in the center. "
@@ -359,40 +932,80 @@ class BCBingoBot(commands.Bot):
     @commands.command(name='bcb')
     async def bcb(self, ctx):
         """
-        !bcb -> bcb [guess|current], reviews your guesses or shows who would win given the current situation.
+        !bcb -> bcb [guess|current|odds], reviews your guesses, shows who would win given the current situation, or which lines are most likely to complete.
         """
         user = ctx.author.name
         try:
             _, subcmd, *_ = ctx.message.content.split(" ")
         except ValueError as e:
-            await ctx.send(f"@{user}, I didn't understand your request. "
-                           f"Must be one of `guess` or `current`")
+            self.say(ctx, f"@{user}, I didn't understand your request. "
+                           f"Must be one of `guess`, `current`, or `odds`")
             return
 
         if subcmd == "guess":
             try:
                 guesses = " | ".join(f"{gt}: {v}" for gt, v in self._pstate[user].items())
-                await ctx.send(f"@{user}, your guesses are: {guesses}")
+                self.say(ctx, f"@{user}, your guesses are: {guesses}")
             except KeyError:
-                await ctx.send(f"@{user}, I don't have guesses recorded for you.")
+                self.say(ctx, f"@{user}, I don't have guesses recorded for you.")
 
         elif subcmd == "current":
             miab_winners = ", ".join("@" + w for w in self._pstate.get_winners("miab", self.miab))
             deaths_winners = ", ".join("@" + w for w in self._pstate.get_winners("deaths", self.deaths))
-            await ctx.send(f"Current MIAB leaders: {miab_winners}")
-            await ctx.send(f"Current deaths leaders: {deaths_winners}")
+            self.say(ctx, f"Current MIAB leaders: {miab_winners}")
+            self.say(ctx, f"Current deaths leaders: {deaths_winners}")
+
+        elif subcmd == "odds":
+            if self._board_url is None:
+                self.say(ctx, f"@{user}, I'm not watching the board, so I can't tell.")
+                return
+
+            # Simulation is numeric work, keep it off the event loop
+            odds = await asyncio.get_running_loop().run_in_executor(
+                None, line_odds, self._board.active, self._board.blocked,
+                self._odds_prob, self._odds_trials
+            )
+            best = sorted(odds.items(), key=lambda t: -t[1][1])[:3]
+            best = " | ".join(f"{line}: {100 * first:.0f}%" for line, (_, first) in best)
+            self.say(ctx, f"@{user}, most likely first lines: {best}")
 
         else:
-            await ctx.send(f"@{user}, I didn't understand your request.")
+            self.say(ctx, f"@{user}, I didn't understand your request.")
     COMMANDS["bcb"] = bcb
 
     @commands.command(name='scoreboard')
     async def scoreboard(self, ctx):
         """
-        !scoreboard -> show the scoreboard for the current seed.
+        !scoreboard -> scoreboard [page|me|all [page]], show a page of the scoreboard for the current seed, your rank, or the scoreboard over every seed.
         """
-        for chunk in format_scoreboard(self._points):
-            await ctx.send(chunk)
+        user = ctx.author.name
+        _, *args = ctx.message.content.lower().split()
+        points = self._points
+        if args and args[0] == "me":
+            if user not in points:
+                self.say(ctx, f"@{user}, you don't have any points yet.")
+                return
+            self.say(ctx, f"@{user}, you are #{points.rank(user)} of "
+                          f"{len(points)} with {points[user]} points.")
+            return
+
+        if args and args[0] == "all" and self._database is not None:
+            args.pop(0)
+            points = Leaderboard(
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self._database.leaderboard
+                )
+            )
+
+        try:
+            page = int(args[0]) if args else 1
+        except ValueError:
+            self.say(ctx, f"@{user}, I didn't understand your request.")
+            return
+
+        pages = points.pages()
+        page = min(max(page, 1), len(pages))
+        self.say(ctx, f"({page}/{len(pages)}) {pages[page - 1]}")
     COMMANDS["scoreboard"] = scoreboard
 
     @commands.command(name='guessbingo', aliases=["bingoguess", "bingo"])
@@ -402,7 +1015,7 @@ class BCBingoBot(commands.Bot):
         """
         user = ctx.author.name
         if "drop" in ctx.message.content or "students" in ctx.message.content:
-            await ctx.send(f"Hilarious as always, @{user}")
+            self.say(ctx, f"Hilarious as always, @{user}")
             return
 
         try:
@@ -410,7 +1023,7 @@ class BCBingoBot(commands.Bot):
 
             value = value.strip().lower()
             if value != "random" and not self._toggle:
-                await ctx.send(f"@{user}, I'm not accepting guesses right now.")
+                self.say(ctx, f"@{user}, I'm not accepting guesses right now.")
                 return
 
             if value == "random":
@@ -418,18 +1031,18 @@ class BCBingoBot(commands.Bot):
 
             if not self._pstate.validate_guess(value):
                 raise ValueError("Invalid bingo specification.")
-            result = self._pstate.guess(user, "bingo", value)
+            result = self._guess(user, "bingo", value)
         except ValueError as e:
             log.error(str(e))
             valid = ", ".join(self._pstate.ALLOWED_BINGO_GUESSES)
-            await ctx.send(f"@{user}, I didn't understand your guess. "
+            self.say(ctx, f"@{user}, I didn't understand your guess. "
                            f"Must be one of {valid}")
             return
 
         if not result:
-            await ctx.send(f"@{user}, you have already guessed this category.")
+            self.say(ctx, f"@{user}, you have already guessed this category.")
             return
-        await ctx.send(f"@{user}, your guess is {value}")
+        self.ack_guess(ctx, user, value)
     COMMANDS["guessbingo"] = guessbingo
 
     @commands.command(name='guessmiab', aliases=["miabguess", "miab"])
@@ -439,23 +1052,23 @@ class BCBingoBot(commands.Bot):
         """
         user = ctx.author.name
         if not self._toggle:
-            await ctx.send(f"@{user}, I'm not accepting guesses right now.")
+            self.say(ctx, f"@{user}, I'm not accepting guesses right now.")
             return
 
         try:
             _, value, *_ = ctx.message.content.split(" ")
             value = int(value.strip().lower())
-            result = self._pstate.guess(user, "miab", value)
+            result = self._guess(user, "miab", value)
         except ValueError as e:
             log.error(str(e))
-            await ctx.send(f"@{user}, I didn't understand your guess. "
+            self.say(ctx, f"@{user}, I didn't understand your guess. "
                             "Please check and retry.")
             return
 
         if not result:
-            await ctx.send(f"@{user}, you have already guessed this category.")
+            self.say(ctx, f"@{user}, you have already guessed this category.")
             return
-        await ctx.send(f"@{user}, your guess is {value}")
+        self.ack_guess(ctx, user, value)
     COMMANDS["guessmiab"] = guessmiab
 
     @commands.command(name='guessdeaths', aliases=["deathsguess", "deaths"])
@@ -465,23 +1078,23 @@ class BCBingoBot(commands.Bot):
         """
         user = ctx.author.name
         if not self._toggle:
-            await ctx.send(f"@{user}, I'm not accepting guesses right now.")
+            self.say(ctx, f"@{user}, I'm not accepting guesses right now.")
             return
 
         try:
             _, value, *_ = ctx.message.content.split(" ")
             value = int(value.strip().lower())
-            result = self._pstate.guess(user, "deaths", value)
+            result = self._guess(user, "deaths", value)
         except ValueError as e:
             log.error(str(e))
-            await ctx.send(f"@{user}, I didn't understand your guess. "
+            self.say(ctx, f"@{user}, I didn't understand your guess. "
                             "Please check and retry.")
             return
 
         if not result:
-            await ctx.send(f"@{user}, you have already guessed this category.")
+            self.say(ctx, f"@{user}, you have already guessed this category.")
             return
-        await ctx.send(f"@{user}, your guess is {value}")
+        self.ack_guess(ctx, user, value)
     COMMANDS["guessdeaths"] = guessdeaths
 
     #
@@ -493,7 +1106,7 @@ class BCBingoBot(commands.Bot):
         Explain what do.
         """
         user = ctx.author.name
-        await ctx.send(f"@{user}: Register guesses with "
+        self.say(ctx, f"@{user}: Register guesses with "
                        f"!guessbingo !guessmiab and !guessdeaths. "
                        f"You can also do !help (command)")
     COMMANDS["bcbingo"] = explain
@@ -515,11 +1128,11 @@ class BCBingoBot(commands.Bot):
             log.error(str(e))
             return
 
-        winners = self._pstate.get_winners("bingo", value)
-        self.assign_points("bingo", value)
+        winners = self.assign_points("bingo", value)
+        self._lines_announced.add(value)
 
-        winners = ", ".join("@" + w for w in self._pstate.get_winners("bingo", value))
-        await ctx.send(f"C H A O S ACHIEVED. Winners for {value}: {winners}")
+        winners = ", ".join("@" + w for w in winners)
+        self.announce(ctx, f"C H A O S ACHIEVED. Winners for {value}: {winners}")
     
     @commands.command(name='miabcount', cls=AuthorizedCommand)
     async def miabcount(self, ctx):
@@ -540,7 +1153,7 @@ class BCBingoBot(commands.Bot):
                     log.error(str(e))
                     return
 
-        await ctx.send(f"@{user}: MiaB count is currently {self.miab}.")
+        self.announce(ctx, f"@{user}: MiaB count is currently {self.miab}.")
 
     @commands.command(name='deathcount', cls=AuthorizedCommand)
     async def deathcount(self, ctx):
@@ -564,7 +1177,7 @@ class BCBingoBot(commands.Bot):
                     log.error(str(e))
                     return
 
-        await ctx.send(f"@{user}: Death count is currently {self.deaths}.")
+        self.announce(ctx, f"@{user}: Death count is currently {self.deaths}.")
 
     #
     # State handling
@@ -586,17 +1199,25 @@ class BCBingoBot(commands.Bot):
         else:
             state = "ON" if self._toggle else "OFF"
 
-        await ctx.send(f"@{user}: Guesses are currently {state}.")
+        self.announce(ctx, f"@{user}: Guesses are currently {state}.")
 
     @commands.command(name='startsegment', aliases=["ss"], cls=AuthorizedCommand)
     async def startsegment(self, ctx):
         """
-        !startsegment -> begins countdown to end of guessing window.
+        !startsegment [minutes] -> begins countdown to end of guessing window.
         """
-        self._timer = self.GUESS_WINDOW
-        min_remain = self._timer // 60
+        _, *value = ctx.message.content.split(" ")
+        try:
+            window = float(value[0]) * 60 if value else self.GUESS_WINDOW
+        except ValueError:
+            log.error(f"Couldn't parse `startsegment` command: {ctx.message.content}")
+            return
+
+        key = f"{ctx.channel.name}/guesses"
+        self._deadlines.start(key, window)
+        self._record("timer", key=key, deadline=self._deadlines.deadlines()[key])
         self._toggle = True
-        await ctx.send(f"Guesses for segment {self._segment} close in {min_remain} minutes.")
+        self.announce(ctx, f"Guesses for segment {self._segment} close in {round(window / 60)} minutes.")
 
     @commands.command(name='opensegment', aliases=["os"], cls=AuthorizedCommand)
     async def opensegment(self, ctx):
@@ -614,7 +1235,7 @@ class BCBingoBot(commands.Bot):
             return
 
         self._toggle = True
-        await ctx.send(f"Guesses for segment {self._segment} are now OPEN.")
+        self.announce(ctx, f"Guesses for segment {self._segment} are now OPEN.")
 
     @commands.command(name='segment', aliases=["s"], cls=AuthorizedCommand)
     async def segment(self, ctx):
@@ -623,13 +1244,13 @@ class BCBingoBot(commands.Bot):
         """
         winners = self.assign_points("miab", self.miab)
         winners = ", ".join("@" + w for w in winners)
-        await ctx.send(f"MiaB guess winners for {self._segment}: {winners}")
+        self.announce(ctx, f"MiaB guess winners for {self._segment}: {winners}")
 
         winners = self.assign_points("deaths", self.deaths)
         winners = ", ".join("@" + w for w in winners)
-        await ctx.send(f"Death guess winners for {self._segment}: {winners}")
+        self.announce(ctx, f"Death guess winners for {self._segment}: {winners}")
 
-        self.serialize()
+        self.save()
 
         _, *value = ctx.message.content.split(" ")
         if len(value) > 0:
@@ -642,7 +1263,7 @@ class BCBingoBot(commands.Bot):
             winner = determine_overall_winner(self._points) or "NOBODY"
             winner_announce = f"And that's a wrap, folks! I do declare, " \
                               f"{winner} is our winner! muppet1Lovester"
-            await ctx.send(winner_announce)
+            self.announce(ctx, winner_announce)
             await self.scoreboard(ctx)
             return
         else:
@@ -655,7 +1276,7 @@ class BCBingoBot(commands.Bot):
         """
         !saveandquit -> save data and shut down
         """
-        self.serialize()
+        await self.save()
         await self.close()
         sys.exit()
 
@@ -671,18 +1292,18 @@ class BCBingoBot(commands.Bot):
         cnt = ctx.message.content.lower().split(" ")
         cnt.pop(0)
         if not cnt:
-            await ctx.send(f"Available commands: {' '.join(self.COMMANDS.keys())}. "
+            self.say(ctx, f"Available commands: {' '.join(self.COMMANDS.keys())}. "
                            f"Use '!help cmd' (no excl. point on cmd) to get more help.")
             return
 
         arg = cnt.pop(0)
         if arg not in self.COMMANDS:
-            await ctx.send(f"@{user}, that's not a command I have help for. "
+            self.say(ctx, f"@{user}, that's not a command I have help for. "
                            f"Available commands: {' '.join(self.COMMANDS.keys())}.")
             return
 
         doc = self.COMMANDS[arg]._callback.__doc__
-        await ctx.send(f"help | {arg}: {doc}")
+        self.say(ctx, f"help | {arg}: {doc}")
     COMMANDS["help"] = _help
 
 if __name__ == "__main__":
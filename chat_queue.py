@@ -0,0 +1,145 @@
+"""
+Outbound chat messages, sent no faster than Twitch allows. Messages wait
+in a priority queue, so announcements and results go out ahead of
+routine replies, and short acknowledgements (e.g., of guesses) arriving
+close together are combined into a few messages.
+"""
+import time
+import heapq
+import asyncio
+import collections
+
+from metrics import METRICS
+
+import logging
+log = logging.getLogger(__name__)
+
+SENT = METRICS.counter("bcbingo_bot_chat_sent_total",
+                       "Chat messages sent, by priority.", ["priority"])
+
+# Message priorities, lower is sent first
+URGENT, NORMAL, BULK = 0, 1, 2
+_PRIORITY_NAMES = ["urgent", "normal", "bulk"]
+
+def join_chunks(items, sep=" | ", max_len=300, prefix=""):
+    """
+    Join items into as few messages as possible, each no longer than
+    max_len unless a single item already is.
+    """
+    out, length = [], len(prefix)
+    for item in items:
+        if out and length + len(sep) + len(item) > max_len:
+            yield prefix + sep.join(out)
+            out, length = [], len(prefix)
+        length += (len(sep) if out else 0) + len(item)
+        out.append(item)
+
+    if out:
+        yield prefix + sep.join(out)
+
+class SlidingWindow:
+    """
+    Allow at most `limit` events in any `period` seconds, by keeping the
+    times of the last `limit` of them.
+    """
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self._times = collections.deque(maxlen=limit)
+
+    def delay(self, now=None):
+        """
+        Seconds until another event is allowed.
+        """
+        if len(self._times) < self.limit:
+            return 0
+        now = time.monotonic() if now is None else now
+        return max(0, self._times[0] + self.period - now)
+
+    async def acquire(self):
+        delay = self.delay()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.delay()
+        self._times.append(time.monotonic())
+
+class ChatQueue:
+    """
+    Send messages to anything with an async `send` (a channel or command
+    context), at most `limit` in any `period` seconds.
+    """
+    def __init__(self, limit=20, period=30, ack_window=1.0, max_len=300):
+        self.ack_window = ack_window
+        self.max_len = max_len
+
+        self._window = SlidingWindow(limit, period)
+        self._heap = []
+        self._seq = 0
+        self._acks = {}
+        self._flush_handle = None
+        self._ready = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def send(self, target, msg, priority=NORMAL):
+        # The sequence number keeps messages of a priority in order
+        heapq.heappush(self._heap, (priority, self._seq, target, msg))
+        self._seq += 1
+        self._ready.set()
+
+    def ack(self, target, text, prefix=""):
+        """
+        Queue a short acknowledgement, to be sent along with others for
+        the same target and prefix queued within `ack_window` seconds.
+        """
+        self._acks.setdefault((target, prefix), []).append(text)
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                self.ack_window, self.flush_acks
+            )
+
+    def flush_acks(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        acks, self._acks = self._acks, {}
+        for (target, prefix), texts in acks.items():
+            for msg in join_chunks(texts, ", ", self.max_len, prefix):
+                self.send(target, msg, BULK)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            # Take the message only once it can be sent, so anything more
+            # urgent queued meanwhile goes first
+            await self._window.acquire()
+            priority, _, target, msg = heapq.heappop(self._heap)
+            if not self._heap:
+                self._ready.clear()
+
+            try:
+                await target.send(msg)
+                SENT.inc(_PRIORITY_NAMES[priority])
+            except Exception as e:
+                log.error(f"Couldn't send chat message: {e}")
+
+    async def close(self, timeout=5):
+        """
+        Send what can be sent within `timeout` seconds, then stop.
+        """
+        self.flush_acks()
+        if self._task is None:
+            return
+
+        deadline = time.monotonic() + timeout
+        while self._heap and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        self._task.cancel()
+        self._task = None
@@ -0,0 +1,77 @@
+"""
+Named deadlines, each with reminders ahead of it, fired by the event
+loop's monotonic clock instead of a polling loop. Deadlines are also kept
+as wall clock times, which is what gets saved, so they carry over a
+restart.
+"""
+import time
+import asyncio
+
+class DeadlineScheduler:
+    def __init__(self, on_deadline, on_reminder=None, reminders=()):
+        """
+        :param on_deadline: called with the key when a deadline passes
+        :param on_reminder: called with the key and the seconds left, at
+            each of `reminders` seconds before a deadline
+        """
+        self.on_deadline = on_deadline
+        self.on_reminder = on_reminder
+        self.reminders = sorted(reminders, reverse=True)
+
+        # key -> wall clock deadline
+        self._deadlines = {}
+        self._handles = {}
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def deadlines(self):
+        return dict(self._deadlines)
+
+    def remaining(self, key):
+        return max(0, self._deadlines[key] - time.time())
+
+    def start(self, key, duration):
+        self.set(key, time.time() + duration)
+
+    def set(self, key, deadline):
+        """
+        Set a deadline, as a wall clock time, replacing any for the same
+        key. Deadlines set before the event loop runs are armed by `arm`,
+        ones already passed fire as soon as they are.
+        """
+        self.cancel(key)
+        self._deadlines[key] = deadline
+        self._arm(key)
+
+    def arm(self):
+        for key in list(self._deadlines):
+            if key not in self._handles:
+                self._arm(key)
+
+    def _arm(self, key):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+
+        remaining = self._deadlines[key] - time.time()
+        at = loop.time() + remaining
+        handles = [loop.call_at(at, self._fire, key)]
+        if self.on_reminder is not None:
+            handles += [loop.call_at(at - before, self.on_reminder, key, before)
+                        for before in self.reminders if before < remaining]
+        self._handles[key] = handles
+
+    def _fire(self, key):
+        self._handles.pop(key, None)
+        self._deadlines.pop(key, None)
+        self.on_deadline(key)
+
+    def cancel(self, key):
+        """
+        Drop a deadline, returning whether there was one.
+        """
+        for handle in self._handles.pop(key, []):
+            handle.cancel()
+        return self._deadlines.pop(key, None) is not None
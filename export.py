@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Export the index and segment boards for one or more seeds as static HTML,
+so they can be hosted on any static file server. Output layout:
+
+    <out>/<name>.html                   index and rules
+    <out>/segment/<seed>/<n>.html       segment boards
+    <out>/assets/<version>/<name>       shared CSS, JS, and images
+
+Seeds are given as they would be in the index URL (/<name>), so the
+exported boards match the live ones. Asset URLs are absolute, so the
+output directory should be served as the site root.
+"""
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bc_bingo import BingoBoard, POOLS, ASSETS, ASSET_FILES, parse_spec, \
+                     index_seed, preload
+
+def _write(fname, content):
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    mode = "wb" if isinstance(content, bytes) else "w"
+    with open(fname, mode) as fout:
+        fout.write(content)
+    return fname
+
+def export_assets(out_dir):
+    return [
+        _write(os.path.join(out_dir, *asset.url.strip("/").split("/")),
+               asset.data)
+        for asset in map(ASSETS.get, ASSET_FILES)
+    ]
+
+def export_seed(name, out_dir):
+    """
+    Write the index and every segment board for the index page at /<name>.
+    Links between pages point at the exported .html files rather than the
+    server routes.
+    """
+    seed = index_seed(name)
+    segments = sorted(POOLS.segments)
+
+    index = BingoBoard.generate_index(seed, len(segments))
+    index = re.sub(rf"(segment/{seed}/\d+)(['\"])", r"\1.html\2", index)
+    written = [_write(os.path.join(out_dir, f"{name}.html"), index)]
+
+    for seg in segments:
+        board = BingoBoard(POOLS.segments[seg], seed=seed, segment=seg)
+        board.generate(seg)
+        html = re.sub(rf"href='\.\./{seed}/(\d+)'", r"href='\1.html'",
+                      board.render())
+        fname = os.path.join(out_dir, "segment", str(seed), f"{seg}.html")
+        written.append(_write(fname, html))
+
+    return written
+
+def export(names, out_dir, workers=None):
+    preload()
+    written = export_assets(out_dir)
+    # Workers which aren't forked from this process load their own copy
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=preload) as pool:
+        for files in pool.map(export_seed, names, [out_dir] * len(names)):
+            written += files
+    return written
+
+if __name__ == "__main__":
+    import argparse
+    argp = argparse.ArgumentParser(
+        description="Export BC Bingo boards as static HTML.")
+    argp.add_argument("seeds", nargs="+",
+                      help="Seeds to export, as in the index URL: names, "
+                           "numbers or ranges (e.g., 1-10).")
+    argp.add_argument("-o", "--out-dir", default="site",
+                      help="Directory to write the site to. "
+                           "Default is 'site'.")
+    argp.add_argument("-j", "--workers", type=int, default=None,
+                      help="Number of worker processes. "
+                           "Default is the number of CPUs.")
+    args = argp.parse_args()
+
+    names = parse_spec(args.seeds, parse=str)
+    start = time.time()
+    written = export(names, args.out_dir, args.workers)
+    print(f"Wrote {len(written)} files for {len(names)} seeds to "
+          f"{args.out_dir} in {time.time() - start:.1f}s")
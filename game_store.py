@@ -0,0 +1,173 @@
+"""
+SQLite storage for the bot: players, guesses for each (seed, segment),
+point totals and awards per seed, and the MiaB and death counts. Changes
+arrive as the same entries the bot journals (see journal.py), and are
+applied a batch at a time in a single transaction.
+"""
+from sqlite_store import SQLiteStore
+
+class GameStore(SQLiteStore):
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS players (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS guesses (
+            seed TEXT NOT NULL,
+            segment INTEGER NOT NULL,
+            player INTEGER NOT NULL REFERENCES players (id),
+            gtype TEXT NOT NULL,
+            value,
+            PRIMARY KEY (seed, segment, player, gtype)
+        );
+        CREATE INDEX IF NOT EXISTS guesses_value
+            ON guesses (seed, segment, gtype, value);
+        CREATE TABLE IF NOT EXISTS points (
+            seed TEXT NOT NULL,
+            player INTEGER NOT NULL REFERENCES players (id),
+            points INTEGER NOT NULL,
+            PRIMARY KEY (seed, player)
+        );
+        CREATE INDEX IF NOT EXISTS points_player ON points (player);
+        CREATE TABLE IF NOT EXISTS awards (
+            id INTEGER PRIMARY KEY,
+            seed TEXT NOT NULL,
+            segment INTEGER NOT NULL,
+            player INTEGER NOT NULL REFERENCES players (id),
+            gtype TEXT NOT NULL,
+            value,
+            points INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS awards_seed ON awards (seed, segment);
+        CREATE TABLE IF NOT EXISTS counts (
+            seed TEXT NOT NULL,
+            segment INTEGER NOT NULL,
+            miab INTEGER NOT NULL DEFAULT 0,
+            deaths INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (seed, segment)
+        );
+    """
+
+    def __init__(self, fname, seed):
+        super().__init__(fname)
+        self.seed = str(seed)
+
+    def _player(self, db, name):
+        db.execute("INSERT OR IGNORE INTO players (name) VALUES (?)", (name,))
+        player, = db.execute("SELECT id FROM players WHERE name = ?",
+                             (name,)).fetchone()
+        return player
+
+    def apply(self, entries):
+        """
+        Apply a batch of state change entries in one transaction.
+        """
+        if not entries:
+            return
+
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for entry in entries:
+                self._apply(db, entry)
+            db.execute("COMMIT")
+        except:
+            db.execute("ROLLBACK")
+            raise
+
+    def _apply(self, db, entry):
+        kind, segment = entry["kind"], entry["segment"]
+        if kind == "guess":
+            player = self._player(db, entry["name"])
+            if entry["value"] is None:
+                db.execute(
+                    "DELETE FROM guesses WHERE seed = ? AND segment = ? "
+                    "AND player = ? AND gtype = ?",
+                    (self.seed, segment, player, entry["gtype"])
+                )
+            else:
+                db.execute(
+                    "INSERT OR REPLACE INTO guesses "
+                    "(seed, segment, player, gtype, value) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (self.seed, segment, player, entry["gtype"],
+                     entry["value"])
+                )
+        elif kind == "points":
+            player = self._player(db, entry["name"])
+            previous = db.execute(
+                "SELECT points FROM points WHERE seed = ? AND player = ?",
+                (self.seed, player)
+            ).fetchone()
+            db.execute(
+                "INSERT OR REPLACE INTO points (seed, player, points) "
+                "VALUES (?, ?, ?)", (self.seed, player, entry["points"])
+            )
+            db.execute(
+                "INSERT INTO awards "
+                "(seed, segment, player, gtype, value, points) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self.seed, segment, player, entry.get("gtype", ""),
+                 entry.get("value"),
+                 entry["points"] - (previous[0] if previous else 0))
+            )
+        elif kind == "game":
+            db.execute(
+                "INSERT OR REPLACE INTO counts (seed, segment, miab, deaths) "
+                "VALUES (?, ?, ?, ?)",
+                (self.seed, entry["segment"], entry["miab"], entry["deaths"])
+            )
+        elif kind == "reset":
+            # Starting (or restarting) a segment, its guesses are cleared
+            db.execute("DELETE FROM guesses WHERE seed = ? AND segment = ?",
+                       (self.seed, segment))
+
+    def points(self):
+        """
+        {player: points} for this seed.
+        """
+        return dict(self._db.execute(
+            "SELECT name, points FROM points JOIN players "
+            "ON players.id = points.player WHERE seed = ?", (self.seed,)
+        ))
+
+    def latest_segment(self):
+        """
+        The last segment played for this seed, None if there were none.
+        """
+        segment, = self._db.execute(
+            "SELECT MAX(segment) FROM ("
+            "SELECT segment FROM counts WHERE seed = ? UNION ALL "
+            "SELECT segment FROM guesses WHERE seed = ?)",
+            (self.seed, self.seed)
+        ).fetchone()
+        return segment
+
+    def guesses(self, segment):
+        """
+        (player, guess type, value) for a segment of this seed.
+        """
+        return self._db.execute(
+            "SELECT name, gtype, value FROM guesses JOIN players "
+            "ON players.id = guesses.player "
+            "WHERE seed = ? AND segment = ?", (self.seed, segment)
+        ).fetchall()
+
+    def counts(self, segment):
+        """
+        (MiaB, deaths) counts for a segment of this seed.
+        """
+        row = self._db.execute(
+            "SELECT miab, deaths FROM counts WHERE seed = ? AND segment = ?",
+            (self.seed, segment)
+        ).fetchone()
+        return row or (0, 0)
+
+    def leaderboard(self):
+        """
+        {player: points} summed over every seed.
+        """
+        return dict(self._db.execute(
+            "SELECT name, SUM(points) FROM points JOIN players "
+            "ON players.id = points.player GROUP BY player"
+        ))
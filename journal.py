@@ -0,0 +1,107 @@
+"""
+Append-only journal of bot state changes, kept between full snapshots of
+the tracking and points files. Entries are JSON lines holding absolute
+values (a player's guess, a player's point total, the game counters), so
+replaying a journal over a snapshot which already includes some of it
+gives the same state.
+
+While a snapshot is being written, the journal it covers is moved aside
+(to `<journal>.old`) and new entries go to a fresh journal. The old one is
+removed once the snapshot is safely written, and replayed first if not.
+"""
+import os
+import json
+import shutil
+
+class Journal:
+    def __init__(self, fname):
+        self.fname = fname
+        self.rotated = fname + ".old"
+        # Entries since the last snapshot, on disk or not
+        self.nentries = 0
+        self._pending = []
+        self._fout = None
+
+    def __len__(self):
+        return self.nentries + len(self._pending)
+
+    @property
+    def dirty(self):
+        return bool(self._pending)
+
+    def append(self, kind, **fields):
+        self._pending.append({"kind": kind, **fields})
+
+    def flush(self):
+        """
+        Write and fsync pending entries, returning how many there were.
+        Nothing is written if there are none.
+        """
+        if not self._pending:
+            return 0
+        if self._fout is None:
+            self._fout = open(self.fname, "a", encoding="utf8")
+
+        self._fout.write("".join(json.dumps(entry) + "\n"
+                                 for entry in self._pending))
+        self._fout.flush()
+        os.fsync(self._fout.fileno())
+
+        nentries = len(self._pending)
+        self.nentries += nentries
+        self._pending = []
+        return nentries
+
+    def rotate(self):
+        """
+        Write out pending entries and move the journal aside, when taking
+        a snapshot which holds everything in it.
+        """
+        self.flush()
+        self.close()
+        self.nentries = 0
+        if not os.path.exists(self.fname):
+            return
+
+        if os.path.exists(self.rotated):
+            # The last snapshot never made it to disk, keep its entries too
+            with open(self.fname, "rb") as fin, \
+                 open(self.rotated, "ab") as fout:
+                shutil.copyfileobj(fin, fout)
+                fout.flush()
+                os.fsync(fout.fileno())
+            os.remove(self.fname)
+        else:
+            os.replace(self.fname, self.rotated)
+
+    def discard_rotated(self):
+        """
+        Remove the moved aside journal, once its snapshot is written.
+        """
+        if os.path.exists(self.rotated):
+            os.remove(self.rotated)
+
+    def close(self):
+        if self._fout is not None:
+            self._fout.close()
+            self._fout = None
+
+    @staticmethod
+    def _read(fname):
+        if not os.path.exists(fname):
+            return
+        with open(fname, encoding="utf8") as fin:
+            for line in fin:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    break
+
+    @classmethod
+    def replay(cls, fname):
+        """
+        Entries of a journal file, including any moved aside one, in
+        order. A partly written last entry, left by a crash, is skipped.
+        """
+        yield from cls._read(fname + ".old")
+        yield from cls._read(fname)
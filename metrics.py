@@ -0,0 +1,252 @@
+"""
+Counters, gauges and latency histograms, rendered in the Prometheus text
+format. Metrics are off by default, and instruments check that before
+doing anything else, so instrumented hot paths cost next to nothing
+unless metrics are enabled.
+
+Counter and histogram values can be taken as plain data snapshots, so
+that processes (e.g., server workers) can be summed up in a single
+rendering.
+"""
+import time
+import bisect
+import inspect
+import functools
+import threading
+import contextlib
+
+# Latency buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Stands in for a timer when metrics are off
+_NO_TIMER = contextlib.nullcontext()
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n") \
+                     .replace('"', '\\"')
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = None
+
+    def __init__(self, registry, name, help, labels=()):
+        self._registry = registry
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _label_pairs(self, values):
+        return list(zip(self.labels, values))
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    @staticmethod
+    def _combine(a, b):
+        return a + b
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), self._copy(value)]
+                    for labels, value in self._values.items()]
+
+    def _merged(self, snapshots, own=True):
+        """
+        {labels: value} of this metric summed with its values in
+        `snapshots`, and its own ones unless `own` is false.
+        """
+        values = {}
+        if own:
+            with self._lock:
+                values = {labels: self._copy(value)
+                          for labels, value in self._values.items()}
+
+        for snapshot in snapshots:
+            for labels, value in snapshot.get(self.name, []):
+                labels = tuple(labels)
+                values[labels] = self._combine(values[labels], value) \
+                                    if labels in values else self._copy(value)
+        return values
+
+    def render(self, snapshots=()):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for name, labels, value in self.samples(snapshots):
+            yield f"{name}{_format_labels(labels)} {_format_value(value)}"
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        if not self._registry.enabled:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self, snapshots=()):
+        for labels, value in sorted(self._merged(snapshots).items()):
+            yield self.name, self._label_pairs(labels), value
+
+class Gauge(Metric):
+    """
+    A value read when rendering, from a function.
+    """
+    kind = "gauge"
+
+    def __init__(self, registry, name, help, read):
+        super().__init__(registry, name, help)
+        self.read = read
+
+    def snapshot(self):
+        # Read in whichever process renders
+        return []
+
+    def samples(self, snapshots=()):
+        yield self.name, [], self.read()
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start,
+                                *self._labels)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(registry, name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    # Values are (bucket counts, total)
+    @staticmethod
+    def _copy(value):
+        counts, total = value
+        return (list(counts), total)
+
+    @staticmethod
+    def _combine(a, b):
+        return ([x + y for x, y in zip(a[0], b[0])], a[1] + b[1])
+
+    def observe(self, value, *labels):
+        if not self._registry.enabled:
+            return
+        with self._lock:
+            counts, total = self._values.get(
+                labels, ([0] * (len(self.buckets) + 1), 0)
+            )
+            # The bucket is the first upper bound >= value
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[labels] = (counts, total + value)
+
+    def time(self, *labels):
+        """
+        Context manager observing how long its block took.
+        """
+        if not self._registry.enabled:
+            return _NO_TIMER
+        return _Timer(self, labels)
+
+    def timed(self, *labels):
+        """
+        Decorator observing how long calls of a function (or coroutine
+        function) take.
+        """
+        def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def wrapper(*args, **kwargs):
+                    with self.time(*labels):
+                        return await func(*args, **kwargs)
+            else:
+                @functools.wraps(func)
+                def wrapper(*args, **kwargs):
+                    with self.time(*labels):
+                        return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def samples(self, snapshots=()):
+        values = self._merged(snapshots)
+        for labels, (counts, total) in sorted(values.items()):
+            pairs = self._label_pairs(labels)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                yield (f"{self.name}_bucket",
+                       pairs + [("le", _format_value(bound))], cumulative)
+            yield f"{self.name}_sum", pairs, total
+            yield f"{self.name}_count", pairs, cumulative
+
+class Registry:
+    def __init__(self):
+        self.enabled = False
+        self._metrics = {}
+
+    def enable(self, enabled=True):
+        self.enabled = bool(enabled)
+
+    def _add(self, cls, name, *args, **kwargs):
+        if name not in self._metrics:
+            self._metrics[name] = cls(self, name, *args, **kwargs)
+        return self._metrics[name]
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=BUCKETS):
+        return self._add(Histogram, name, help, labels, buckets)
+
+    def gauge(self, name, help, read):
+        """
+        Gauge reading its value from `read()`, replacing any gauge of the
+        same name.
+        """
+        self._metrics.pop(name, None)
+        return self._add(Gauge, name, help, read)
+
+    def snapshot(self):
+        """
+        Counter and histogram values, as plain (JSON serializable) data.
+        """
+        return {name: metric.snapshot()
+                for name, metric in self._metrics.items()}
+
+    def combine(self, snapshots):
+        """
+        A single snapshot summing up `snapshots`.
+        """
+        return {name: [[list(labels), value] for labels, value
+                       in metric._merged(snapshots, own=False).items()]
+                for name, metric in self._metrics.items()}
+
+    def render(self, snapshots=()):
+        """
+        Render every metric, summing in any snapshots of other processes.
+        """
+        return "".join(line + "\n" for metric in self._metrics.values()
+                       for line in metric.render(snapshots))
+
+# Metrics for this process
+METRICS = Registry()
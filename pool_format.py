@@ -0,0 +1,190 @@
+"""
+Compact binary format for square pools, checked when it is written and
+memory-mapped by the board server instead of reading the CSVs, so forked
+workers share it through the page cache. Layout (little endian):
+
+    header      magic "BCBP", format version (u16), number of strings,
+                records and groups (u32 each)
+    strings     (nstrings + 1) u32 offsets into a UTF-8 blob, then the blob
+    records     index (u32), square, help, segment, type (u32 string ids),
+                segment index, choices (u16, 0 if not given)
+    groups      segment index (u16), type (u32 string id), choices (u16),
+                first record, number of records (u32)
+
+Strings are interned, and records are sorted by segment index and
+(type, choices), keeping source order within a group, so every group is a
+contiguous run of records.
+"""
+import mmap
+import struct
+import hashlib
+
+MAGIC = b"BCBP"
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("<4sHIII")
+_OFFSET = struct.Struct("<I")
+_RECORD = struct.Struct("<IIIIIHH")
+_GROUP = struct.Struct("<HIHII")
+
+class PoolFormatError(ValueError):
+    pass
+
+def _choices(row):
+    return int(row["choices"] or "1")
+
+def _group_key(row):
+    return (int(row["segment_index"]), row["type"], _choices(row))
+
+def validate(rows, nsquares=25):
+    """
+    Check that pool rows can make boards: segment indices are positive
+    integers, every group has enough squares to sample its number of
+    choices, and the choices for each segment fill a board.
+    """
+    problems = []
+    counts, choices = {}, {}
+    for row in rows:
+        try:
+            key = _group_key(row)
+        except (TypeError, ValueError):
+            problems.append(f"Row {row.get('index')}: bad segment index "
+                            f"or choices ({row.get('segment_index')!r}, "
+                            f"{row.get('choices')!r})")
+            continue
+        if key[0] < 1:
+            problems.append(f"Row {row.get('index')}: segment index must be "
+                            f"positive, got {key[0]}")
+        counts[key] = counts.get(key, 0) + 1
+
+    for (seg, type_, nchoice), count in counts.items():
+        if count < nchoice:
+            problems.append(f"Segment {seg} group {type_} has {count} "
+                            f"squares, fewer than its {nchoice} choices")
+        choices[seg] = choices.get(seg, 0) + nchoice
+
+    for seg, total in sorted(choices.items()):
+        if total != nsquares:
+            problems.append(f"Segment {seg} chooses {total} squares, "
+                            f"but a board needs {nsquares}")
+
+    if problems:
+        raise PoolFormatError("\n".join(problems))
+
+def write_pool(fname, rows):
+    rows = sorted(rows, key=_group_key)
+
+    strings, ids = [], {}
+    def intern(value):
+        value = value or ""
+        if value not in ids:
+            ids[value] = len(strings)
+            strings.append(value)
+        return ids[value]
+
+    records, groups = [], []
+    for i, row in enumerate(rows):
+        key = _group_key(row)
+        records.append(_RECORD.pack(
+            int(row["index"]), intern(row["square"]), intern(row.get("help")),
+            intern(row["segment"]), intern(row["type"]),
+            key[0], int(row["choices"] or 0)
+        ))
+        if not groups or groups[-1][0] != key:
+            groups.append([key, i, 0])
+        groups[-1][2] += 1
+
+    blob = [s.encode("utf8") for s in strings]
+    offsets = [0]
+    for data in blob:
+        offsets.append(offsets[-1] + len(data))
+
+    with open(fname, "wb") as fout:
+        fout.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(strings),
+                                len(records), len(groups)))
+        fout.write(b"".join(_OFFSET.pack(off) for off in offsets))
+        fout.write(b"".join(blob))
+        fout.write(b"".join(records))
+        fout.write(b"".join(
+            _GROUP.pack(seg, ids[type_], nchoice, first, count)
+            for (seg, type_, nchoice), first, count in groups
+        ))
+
+class BinaryPool:
+    """
+    Read-only, memory-mapped view of a compiled pool file. Rows come back
+    as dicts shaped like the CSV rows.
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        with open(fname, "rb") as fin:
+            self._buf = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, nstrings, nrecords, ngroups = \
+                _HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise PoolFormatError(f"{fname} is not a version "
+                                  f"{FORMAT_VERSION} pool file")
+
+        pos = _HEADER.size
+        self._offsets = pos
+        self._blob = pos + (nstrings + 1) * _OFFSET.size
+        blob_len, = _OFFSET.unpack_from(self._buf,
+                                        pos + nstrings * _OFFSET.size)
+        self._records = self._blob + blob_len
+        self._groups = self._records + nrecords * _RECORD.size
+        self.ngroups = ngroups
+
+        self.version = hashlib.sha1(self._buf).hexdigest()[:12]
+
+    def _string(self, sid):
+        start, end = struct.unpack_from("<II", self._buf,
+                                        self._offsets + sid * _OFFSET.size)
+        return self._buf[self._blob + start:self._blob + end].decode("utf8")
+
+    def row(self, i):
+        index, square, help_, segment, type_, seg_index, choices = \
+                _RECORD.unpack_from(self._buf, self._records + i * _RECORD.size)
+        return {
+            "index": str(index),
+            "square": self._string(square),
+            "segment": self._string(segment),
+            "segment_index": str(seg_index),
+            "choices": str(choices) if choices else "",
+            "type": self._string(type_),
+            "help": self._string(help_),
+        }
+
+    def _group_table(self):
+        for g in range(self.ngroups):
+            yield _GROUP.unpack_from(self._buf, self._groups + g * _GROUP.size)
+
+    @property
+    def segments(self):
+        return sorted({seg for seg, *_ in self._group_table()})
+
+    def groups(self, segment_index):
+        """
+        {(type, choices): rows} for a segment, in the same order as sorting
+        and grouping the CSV rows.
+        """
+        return {
+            (self._string(type_), choices or 1):
+                [self.row(i) for i in range(first, first + count)]
+            for seg, type_, choices, first, count in self._group_table()
+            if seg == segment_index
+        }
+
+    def group_ranges(self, segment_index):
+        """
+        {(type, choices): record numbers} for a segment, in the same order
+        as groups(), without decoding any records.
+        """
+        return {
+            (self._string(type_), choices or 1): range(first, first + count)
+            for seg, type_, choices, first, count in self._group_table()
+            if seg == segment_index
+        }
+
+    def close(self):
+        self._buf.close()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+"""
+Production server for the bingo boards. The parent process preloads the
+segment pools, rules, and assets, binds the listening socket, and forks
+worker processes which share that memory copy-on-write. Each worker is a
+threaded WSGI server accepting on the shared socket.
+
+Signals to the parent:
+
+ - SIGHUP: graceful restart, reload from disk and replace the workers
+ - SIGTERM / SIGINT: graceful shutdown
+
+Workers which exit unexpectedly are replaced.
+
+With a metrics port, workers record request metrics and write snapshots
+of them to a temporary directory every second (and when they stop). The
+parent sums them up, keeping the last values of workers which have
+exited so counters never go backwards, and serves them on localhost.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+
+from werkzeug.serving import make_server
+
+import bc_bingo
+import server
+from metrics import CONTENT_TYPE
+
+import logging
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+class PreforkServer:
+    # Seconds between worker metrics snapshots
+    METRICS_INTERVAL = 1.0
+
+    def __init__(self, app, host="127.0.0.1", port=5000, workers=None,
+                 graceful_timeout=30, metrics_port=None):
+        self.app = app
+        self.host, self.port = host, port
+        self.nworkers = workers or os.cpu_count() or 1
+        self.graceful_timeout = graceful_timeout
+        self.metrics_port = metrics_port
+
+        self._sock = None
+        # pid -> time it was asked to stop (None if still serving)
+        self._workers = {}
+        self._signals = []
+
+        self._metrics_dir = None
+        self._metrics_httpd = None
+        # Sum of the last snapshots of workers which have exited
+        self._retired = {}
+        self._metrics_lock = threading.Lock()
+
+    #
+    # Worker side
+    #
+    def _write_metrics(self):
+        fname = os.path.join(self._metrics_dir, f"{os.getpid()}.json")
+        with open(fname + ".tmp", "w") as fout:
+            json.dump(server.METRICS.snapshot(), fout)
+        os.replace(fname + ".tmp", fname)
+
+    def _metrics_loop(self, stop):
+        while not stop.wait(self.METRICS_INTERVAL):
+            try:
+                self._write_metrics()
+            except OSError as e:
+                log.error(f"Couldn't write metrics: {e}")
+
+    def _serve(self):
+        for sig in (signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, signal.SIG_IGN)
+
+        if self._metrics_httpd is not None:
+            # Only the parent answers metrics requests
+            self._metrics_httpd.server_close()
+            stop_metrics = threading.Event()
+            metrics_thread = threading.Thread(target=self._metrics_loop,
+                                              args=(stop_metrics,))
+            metrics_thread.start()
+
+        httpd = make_server(self.host, self.port, self.app, threaded=True,
+                             fd=self._sock.fileno())
+
+        def stop(signum, frame):
+            # shutdown() blocks until serve_forever exits, so can't be
+            # called from the serving thread itself
+            threading.Thread(target=httpd.shutdown).start()
+        signal.signal(signal.SIGTERM, stop)
+
+        httpd.serve_forever()
+        # End live update streams, clients will reconnect to another worker
+        server.BROKER.close()
+        if self._metrics_httpd is not None:
+            stop_metrics.set()
+            metrics_thread.join()
+
+        # Let in-flight requests finish, up to the timeout
+        deadline = time.monotonic() + self.graceful_timeout
+        while threading.active_count() > 1 and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+        if self._metrics_httpd is not None:
+            self._write_metrics()
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._serve()
+            except Exception as e:
+                log.error(f"Worker {os.getpid()} failed: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+
+        self._workers[pid] = None
+        log.info(f"Started worker {pid}")
+        return pid
+
+    #
+    # Parent side
+    #
+    def _read_metrics(self, pid):
+        try:
+            with open(os.path.join(self._metrics_dir, f"{pid}.json")) as fin:
+                return json.load(fin)
+        except (OSError, ValueError):
+            return {}
+
+    def _retire_metrics(self, pid):
+        # Called holding the metrics lock
+        self._retired = server.METRICS.combine(
+            [self._retired, self._read_metrics(pid)]
+        )
+        fname = os.path.join(self._metrics_dir, f"{pid}.json")
+        if os.path.exists(fname):
+            os.remove(fname)
+
+    def _metrics_app(self, environ, start_response):
+        if environ.get("PATH_INFO") != "/metrics":
+            start_response("404 Not Found", [("Content-Type", "text/plain")])
+            return [b"Not found\n"]
+
+        with self._metrics_lock:
+            snapshots = [self._retired] + [self._read_metrics(pid)
+                                           for pid in list(self._workers)]
+        body = server.METRICS.render(snapshots).encode("utf8")
+        start_response("200 OK", [("Content-Type", CONTENT_TYPE)])
+        return [body]
+
+    def _stop(self, pids):
+        for pid in pids:
+            if self._workers.get(pid, 0) is None:
+                self._workers[pid] = time.monotonic()
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+    def _reap(self):
+        while self._workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+
+            # A worker's metrics move to the retired ones at once, so they
+            # are never missed nor counted twice
+            with self._metrics_lock:
+                stopped = self._workers.pop(pid, None)
+                if self._metrics_dir is not None:
+                    self._retire_metrics(pid)
+            if stopped is None:
+                log.warning(f"Worker {pid} exited unexpectedly "
+                            f"(status {status})")
+
+        # Kill workers which overran the graceful timeout
+        now = time.monotonic()
+        for pid, stopped in self._workers.items():
+            if stopped is not None and now - stopped > self.graceful_timeout:
+                log.warning(f"Worker {pid} did not stop in time, killing.")
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def _serving(self):
+        return [pid for pid, stopped in self._workers.items()
+                if stopped is None]
+
+    def restart(self):
+        log.info("Reloading and restarting workers.")
+        old = self._serving()
+        bc_bingo.reload()
+        for _ in range(self.nworkers):
+            self._spawn()
+        self._stop(old)
+
+    def run(self):
+        self._sock = socket.create_server((self.host, self.port),
+                                          backlog=1024)
+        self._sock.set_inheritable(True)
+        # Pools, rules and assets were preloaded on importing server (not
+        # bc_bingo), before any fork, so workers share them copy-on-write
+        log.info(f"Serving on http://{self.host}:{self.port} "
+                 f"with {self.nworkers} workers")
+
+        if self.metrics_port is not None:
+            self._metrics_dir = tempfile.mkdtemp(prefix="bcbingo-metrics-")
+            self._metrics_httpd = serve_metrics(self.metrics_port,
+                                                self._metrics_app)
+
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda signum, frame:
+                                    self._signals.append(signum))
+
+        running = True
+        while running or self._workers:
+            while self._signals:
+                sig = self._signals.pop(0)
+                if sig == signal.SIGHUP and running:
+                    self.restart()
+                elif sig in (signal.SIGTERM, signal.SIGINT):
+                    log.info("Shutting down workers.")
+                    running = False
+                    self._stop(self._serving())
+
+            self._reap()
+            if running:
+                for _ in range(self.nworkers - len(self._serving())):
+                    self._spawn()
+
+            time.sleep(0.2)
+
+        self._sock.close()
+        if self._metrics_httpd is not None:
+            self._metrics_httpd.shutdown()
+            shutil.rmtree(self._metrics_dir, ignore_errors=True)
+
+def _metrics_app(environ, start_response):
+    # This process's own metrics, for the single process server
+    if environ.get("PATH_INFO") != "/metrics":
+        start_response("404 Not Found", [("Content-Type", "text/plain")])
+        return [b"Not found\n"]
+    start_response("200 OK", [("Content-Type", CONTENT_TYPE)])
+    return [server.METRICS.render().encode("utf8")]
+
+def serve_metrics(port, app=_metrics_app):
+    """
+    Serve metrics on http://127.0.0.1:<port>/metrics from a background
+    thread, returning the server.
+    """
+    httpd = make_server("127.0.0.1", port, app)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    log.info(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+    return httpd
+
+def serve_single(app, host, port, metrics_port=None):
+    """
+    Fallback for platforms without fork: one threaded server process.
+    """
+    if metrics_port is not None:
+        serve_metrics(metrics_port)
+    log.info(f"Serving on http://{host}:{port} with a single process")
+    make_server(host, port, app, threaded=True).serve_forever()
+
+if __name__ == "__main__":
+    import argparse
+    argp = argparse.ArgumentParser(
+        description="Serve BC Bingo boards with a pool of worker processes.")
+    argp.add_argument("-H", "--host", default="127.0.0.1",
+                      help="Address to listen on. Default is 127.0.0.1.")
+    argp.add_argument("-p", "--port", type=int, default=5000,
+                      help="Port to listen on. Default is 5000.")
+    argp.add_argument("-w", "--workers", type=int, default=None,
+                      help="Number of worker processes. "
+                           "Default is the number of CPUs.")
+    argp.add_argument("-t", "--graceful-timeout", type=float, default=30,
+                      help="Seconds to let workers finish requests when "
+                           "stopping or restarting. Default is 30.")
+    argp.add_argument("-m", "--metrics-port", type=int, default=None,
+                      help="Serve request metrics, summed over workers, on "
+                           "http://127.0.0.1:<port>/metrics. Default is "
+                           "no metrics.")
+    args = argp.parse_args()
+
+    if args.metrics_port is not None:
+        server.METRICS.enable()
+
+    if not hasattr(os, "fork"):
+        log.warning("Worker processes are not supported on this platform.")
+        serve_single(server.app, args.host, args.port, args.metrics_port)
+        sys.exit()
+
+    PreforkServer(server.app, args.host, args.port, args.workers,
+                  args.graceful_timeout, args.metrics_port).run()
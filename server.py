@@ -0,0 +1,312 @@
+"""
+Flask app serving the boards, rules, assets, and live board state. The
+segment pools and assets are loaded and pre-rendered on import.
+"""
+import time
+import json
+import queue
+import urllib.parse
+
+import flask
+from flask import Flask
+
+from bc_bingo import BingoBoard, POOLS, ASSETS, ASSET_MAX_AGE, \
+                     render_cached_board, parse_seed, parse_spec, index_seed, \
+                     preload
+from board_state import BoardStateStore, StateBroker, state_diff, \
+                        NSQUARES, SQUARE_STATES
+from bingo_lines import to_masks, line_odds
+from metrics import METRICS
+
+# Shared, server-side board states for racers
+STATES = BoardStateStore()
+BROKER = StateBroker(STATES)
+MAX_RACER_LEN = 64
+# Default per square completion chance and cap on trials for line odds
+ODDS_SQUARE_PROB = 0.5
+MAX_ODDS_TRIALS = 1000000
+
+# Seconds between keep-alive comments on idle live update streams
+LIVE_HEARTBEAT = 15
+
+# Board counters must fit in a (signed 32 bit) database integer
+MAX_COUNTER = 2**31 - 1
+
+# Upper limit on the number of boards generated in one batch request
+MAX_BATCH_BOARDS = 10000
+
+# Request metrics, enabled and served by serve.py with --metrics-port
+REQUESTS = METRICS.counter("bcbingo_server_requests_total",
+                           "Requests handled, by endpoint and status.",
+                           ["endpoint", "status"])
+REQUEST_SECONDS = METRICS.histogram("bcbingo_server_request_seconds",
+                                    "Time handling requests, by endpoint.",
+                                    ["endpoint"])
+RENDER_SECONDS = METRICS.histogram("bcbingo_server_board_render_seconds",
+                                   "Time getting rendered boards, including "
+                                   "cache hits.")
+
+app = Flask(__name__)
+preload()
+
+@app.before_request
+def start_timer():
+    if METRICS.enabled:
+        flask.g.start_time = time.perf_counter()
+
+@app.after_request
+def record_request(resp):
+    if METRICS.enabled and "start_time" in flask.g:
+        endpoint = flask.request.endpoint or "none"
+        REQUEST_SECONDS.observe(time.perf_counter() - flask.g.start_time,
+                                endpoint)
+        REQUESTS.inc(endpoint, str(resp.status_code))
+    return resp
+
+@app.route("/", defaults={"seed": None})
+@app.route("/<seed>")
+def render_index(seed):
+    if seed is not None:
+        seed = index_seed(seed)
+    else:
+        seed = int(time.time())
+
+    return BingoBoard.generate_index(seed, len(POOLS.segments))
+
+@app.route("/segment/", defaults={"seed": None, "seg": "1"})
+@app.route("/segment/<seed>", defaults={"seed": None})
+@app.route("/segment/<seed>/<seg>")
+def render_board(seg, seed):
+    try:
+        seg = int(seg)
+        pool = POOLS.get(f"segments/segment_{seg}.csv")
+    except (ValueError, FileNotFoundError):
+        flask.abort(404)
+
+    with RENDER_SECONDS.time():
+        html, etag = render_cached_board(parse_seed(seed), seg, pool.version)
+
+    resp = flask.Response(html)
+    resp.set_etag(etag)
+    # Allow caching, but always revalidate so state changes are picked up
+    resp.cache_control.no_cache = True
+    return resp.make_conditional(flask.request)
+
+@app.route("/api/boards", methods=["GET", "POST"])
+def batch_boards():
+    """
+    Generate boards in bulk. Takes `seeds` and optionally `segments`,
+    either as query parameters ("1,2,10-20") or as a JSON body (lists or
+    the same string format).
+    """
+    opts = flask.request.get_json(silent=True) or flask.request.args
+    if "seeds" not in opts:
+        return flask.jsonify({"error": "No seeds given."}), 400
+
+    try:
+        # Neither can have more values than there may be boards
+        seeds = parse_spec(opts["seeds"], MAX_BATCH_BOARDS)
+        segments = opts.get("segments")
+        segments = None if segments is None \
+                        else parse_spec(segments, MAX_BATCH_BOARDS, parse=int)
+    except (TypeError, ValueError) as e:
+        return flask.jsonify({"error": f"Could not parse request: {e}."}), 400
+
+    if segments is not None and not set(segments) <= set(POOLS.segments):
+        valid = ", ".join(map(str, sorted(POOLS.segments)))
+        return flask.jsonify({"error": f"Segments must be in {valid}."}), 400
+
+    nboards = len(seeds) * len(segments or POOLS.segments)
+    if nboards > MAX_BATCH_BOARDS:
+        return flask.jsonify({"error": f"Too many boards requested "
+                                       f"({nboards} > {MAX_BATCH_BOARDS})."}), 400
+
+    return flask.jsonify({"boards": BingoBoard.generate_batch(seeds, segments)})
+
+def parse_state_update(opts):
+    """
+    Validate a board state update, which may set all squares, a single
+    square, and/or the counters.
+    """
+    if not isinstance(opts, dict):
+        raise TypeError("Expected a JSON object")
+
+    nstates = len(SQUARE_STATES)
+    update = {}
+    if "squares" in opts:
+        squares = [int(sq) for sq in opts["squares"]]
+        if len(squares) != NSQUARES \
+                or not all(0 <= sq < nstates for sq in squares):
+            raise ValueError(f"squares must be {NSQUARES} values "
+                             f"in [0, {nstates})")
+        update["squares"] = squares
+
+    if "square" in opts:
+        idx, value = int(opts["square"]), int(opts.get("state", 0))
+        if not (0 <= idx < NSQUARES and 0 <= value < nstates):
+            raise ValueError("Invalid square or state")
+        update["square"] = (idx, value)
+
+    for counter in ("miab", "deaths"):
+        if counter in opts:
+            value = max(0, int(opts[counter]))
+            if value > MAX_COUNTER:
+                raise ValueError(f"{counter} must be at most {MAX_COUNTER}")
+            update[counter] = value
+
+    return update
+
+def _with_share(state):
+    return {**state, "share": f"/s/{state['code']}"}
+
+@app.route("/api/state/<seed>/<seg>/<racer>", methods=["GET", "POST"])
+def board_state(seed, seg, racer):
+    """
+    Read or update a racer's board. The response to a board's first update
+    has a `token`, which later updates must send as X-Board-Token.
+    """
+    try:
+        seg = int(seg)
+    except ValueError:
+        flask.abort(404)
+    if seg not in POOLS.segments or len(racer) > MAX_RACER_LEN:
+        flask.abort(404)
+    seed = parse_seed(seed)
+
+    if flask.request.method == "GET":
+        return flask.jsonify(_with_share(STATES.get(seed, seg, racer)))
+
+    opts = flask.request.get_json(silent=True)
+    try:
+        update = parse_state_update(opts)
+    except (TypeError, ValueError, OverflowError) as e:
+        return flask.jsonify({"error": str(e)}), 400
+
+    try:
+        state = STATES.update(seed, seg, racer,
+                              flask.request.headers.get("X-Board-Token"),
+                              **update)
+    except PermissionError as e:
+        return flask.jsonify({"error": str(e)}), 403
+    BROKER.notify()
+    return flask.jsonify(_with_share(state))
+
+@app.route("/live/<seed>/<seg>")
+def live_board(seed, seg):
+    """
+    Server-sent events stream of board state changes for a seed and
+    segment, optionally only for one racer. The first events carry the
+    full current state, later ones only what changed.
+    """
+    try:
+        seg = int(seg)
+    except ValueError:
+        flask.abort(404)
+    if seg not in POOLS.segments:
+        flask.abort(404)
+    seed = str(parse_seed(seed))
+    racer = flask.request.args.get("racer")
+
+    def event(diff):
+        return f"data: {json.dumps(diff)}\n\n"
+
+    def stream():
+        # Subscribe before reading the current state, so nothing is missed
+        subscriber = BROKER.subscribe(seed, seg)
+        try:
+            yield "retry: 3000\n\n"
+            for state in STATES.get_all(seed, seg):
+                if racer is None or state["racer"] == racer:
+                    yield event(state_diff(None, state))
+
+            while True:
+                try:
+                    diff = subscriber.get(timeout=LIVE_HEARTBEAT)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+
+                if diff is BROKER.CLOSED:
+                    return
+                if racer is None or diff["racer"] == racer:
+                    yield event(diff)
+        finally:
+            BROKER.unsubscribe(seed, seg, subscriber)
+
+    return flask.Response(stream(), mimetype="text/event-stream",
+                          headers={"Cache-Control": "no-cache",
+                                   "X-Accel-Buffering": "no"})
+
+@app.route("/api/odds/<seed>/<seg>/<racer>", methods=["GET", "POST"])
+def board_odds(seed, seg, racer):
+    """
+    Estimated chance of each line completing (and completing first) from
+    the racer's current board. Takes `trials` and either `p`, the chance
+    any open square is completed, or `probs`, one chance per square (JSON
+    body only).
+    """
+    try:
+        seg = int(seg)
+    except ValueError:
+        flask.abort(404)
+    if seg not in POOLS.segments or len(racer) > MAX_RACER_LEN:
+        flask.abort(404)
+
+    opts = flask.request.get_json(silent=True) or flask.request.args
+    try:
+        ntrials = int(opts.get("trials", 200000))
+        prob = opts.get("probs", opts.get("p", ODDS_SQUARE_PROB))
+        prob = [float(p) for p in prob] if isinstance(prob, list) \
+                    else float(prob)
+        if not 0 < ntrials <= MAX_ODDS_TRIALS:
+            raise ValueError(f"trials must be in (0, {MAX_ODDS_TRIALS}]")
+        if isinstance(prob, list) and len(prob) != NSQUARES:
+            raise ValueError(f"probs must have {NSQUARES} values")
+        # NaN fails the comparison too
+        if not all(0 <= p <= 1 for p in (prob if isinstance(prob, list)
+                                          else [prob])):
+            raise ValueError("p and probs must be in [0, 1]")
+    except (TypeError, ValueError, OverflowError) as e:
+        return flask.jsonify({"error": str(e)}), 400
+
+    state = STATES.get(parse_seed(seed), seg, racer)
+    active, blocked = to_masks(state["squares"])
+    odds = line_odds(active, blocked, prob, ntrials)
+    return flask.jsonify({
+        "trials": ntrials,
+        "lines": {
+            line: {"complete": complete, "first": first}
+            for line, (complete, first) in odds.items()
+        }
+    })
+
+@app.route("/s/<code>")
+def share_link(code):
+    state = STATES.resolve(code)
+    if state is None:
+        flask.abort(404)
+
+    # A read-only view, only the racer's own page changes the board
+    query = urllib.parse.urlencode({"watch": state["racer"]})
+    return flask.redirect(f"/segment/{state['seed']}/{state['segment']}"
+                          f"?{query}")
+
+@app.route("/assets/<version>/<name>")
+def serve_asset(version, name):
+    try:
+        asset = ASSETS.get(name)
+    except KeyError:
+        flask.abort(404)
+
+    resp = flask.Response(asset.data, mimetype=asset.mimetype)
+    resp.set_etag(asset.version)
+    resp.last_modified = asset.last_modified
+    if version == asset.version:
+        resp.cache_control.public = True
+        resp.cache_control.max_age = ASSET_MAX_AGE
+        resp.cache_control.immutable = True
+    else:
+        # Stale or guessed version, serve current content but revalidate
+        resp.cache_control.no_cache = True
+
+    return resp.make_conditional(flask.request)
@@ -0,0 +1,43 @@
+"""
+Base for the SQLite backed stores, which several threads (and forked
+server workers) use at once.
+"""
+import os
+import sqlite3
+import threading
+
+class SQLiteStore:
+    """
+    Keeps a connection per thread and process to `fname`, in WAL mode, in
+    autocommit mode (transactions are begun explicitly), with `_SCHEMA`
+    created on connecting.
+    """
+    _SCHEMA = ""
+
+    def __init__(self, fname):
+        self.fname = fname
+        self._local = threading.local()
+        self._pid = None
+
+    def _setup(self, db):
+        """
+        Called with each new connection, after creating the schema.
+        """
+
+    @property
+    def _db(self):
+        # Connections can't be shared across threads or forked processes
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.fname, timeout=10,
+                                 isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(self._SCHEMA)
+            self._setup(db)
+            self._local.db = db
+        return db
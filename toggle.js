@@ -1,4 +1,8 @@
 function toggleState(obj) {
+    if (isWatching()) {
+        return;
+    }
+
     if (obj.className == 'bingo_sq inactive') {
 	    obj.className = 'bingo_sq active';
     } else if (obj.className == 'bingo_sq active') {
@@ -15,6 +19,10 @@ function toggleState(obj) {
 }
 
 function incCounterDeaths(inc) {
+    if (isWatching()) {
+        return;
+    }
+
     cnt = document.getElementById("death_counter");
     var val = parseInt(cnt.textContent);
     val = inc ? val + 1 : val - 1;
@@ -25,6 +33,10 @@ function incCounterDeaths(inc) {
 }
 
 function incCounterMIAB(inc) {
+    if (isWatching()) {
+        return;
+    }
+
     cnt = document.getElementById("miab_counter");
     var val = parseInt(cnt.textContent);
     val = inc ? val + 1 : val - 1;
@@ -34,6 +46,106 @@ function incCounterMIAB(inc) {
     updateState();
 }
 
+// Boards opened with ?racer=<name> keep their state on the server, and
+// ?watch=<name> (share links) shows that state without changing it
+function getRacer() {
+    let params = new URLSearchParams(window.location.search);
+    return params.get('racer') || params.get('watch');
+}
+
+function isWatching() {
+    let params = new URLSearchParams(window.location.search);
+    return params.get('racer') === null && params.get('watch') !== null;
+}
+
+function stateUrl() {
+    // page is at /segment/<seed>/<seg>
+    let [seed, seg] = window.location.pathname.split("/").slice(-2);
+    return "/api/state/" + seed + "/" + seg + "/" + encodeURIComponent(getRacer());
+}
+
+function applyState(state) {
+    document.getElementById("death_counter").textContent = state.deaths.toString();
+    document.getElementById("miab_counter").textContent = state.miab.toString();
+    setStateList(state.squares);
+}
+
+function loadStateFromServer() {
+    fetch(stateUrl())
+        .then((resp) => resp.json())
+        .then(applyState);
+}
+
+function applyDiff(diff) {
+    let possible_states = [
+        "inactive",
+        "active",
+        "blocked"
+    ];
+
+    if (diff.deaths !== undefined) {
+        document.getElementById("death_counter").textContent = diff.deaths.toString();
+    }
+    if (diff.miab !== undefined) {
+        document.getElementById("miab_counter").textContent = diff.miab.toString();
+    }
+    if (diff.squares !== undefined) {
+        let nodes = document.querySelectorAll('.bingo_sq');
+        for (const [i, state] of Object.entries(diff.squares)) {
+            nodes[i].className = "bingo_sq " + possible_states[state];
+        }
+    }
+}
+
+function subscribeToServer() {
+    // stream of changes, e.g., from the racer's own page to overlays
+    let [seed, seg] = window.location.pathname.split("/").slice(-2);
+    let url = "/live/" + seed + "/" + seg + "?racer=" + encodeURIComponent(getRacer());
+    let source = new EventSource(url);
+    source.onmessage = (event) => applyDiff(JSON.parse(event.data));
+}
+
+function saveStateToServer() {
+    let possible_states = [
+        "inactive",
+        "active",
+        "blocked"
+    ];
+    let squares = [...document.querySelectorAll('.bingo_sq')].map((node) => {
+        return possible_states.indexOf(node.className.split(" ")[1]);
+    });
+
+    // the server hands out a token on the board's first save, which
+    // every later save has to send
+    let tokenKey = "bcbingo-token:" + stateUrl();
+    let headers = {"Content-Type": "application/json"};
+    let token = window.localStorage.getItem(tokenKey);
+    if (token !== null) {
+        headers["X-Board-Token"] = token;
+    }
+
+    fetch(stateUrl(), {
+        method: "POST",
+        headers: headers,
+        body: JSON.stringify({
+            squares: squares,
+            deaths: parseInt(document.getElementById("death_counter").innerText),
+            miab: parseInt(document.getElementById("miab_counter").innerText),
+        }),
+    }).then((resp) => {
+        if (resp.status == 403) {
+            console.log("Board belongs to another racer, not saving");
+            loadStateFromServer();
+            return;
+        }
+        return resp.json().then((state) => {
+            if (state.token !== undefined) {
+                window.localStorage.setItem(tokenKey, state.token);
+            }
+        });
+    });
+}
+
 function loadStateFromQParams() {
     let params = new URLSearchParams(window.location.search);
 
@@ -47,6 +159,13 @@ function loadStateFromQParams() {
 }
 
 function updateState() {
+    if (getRacer() !== null) {
+        if (!isWatching()) {
+            saveStateToServer();
+        }
+        return;
+    }
+
     let url = window.location.href.split("?")[0];
     // TODO: get death and MIAB counters
     console.log("Updating state");
@@ -65,7 +184,12 @@ function updateState() {
 
 window.addEventListener("load", (event) => {
     console.log("Checking for state.");
-    loadStateFromQParams();
+    if (getRacer() !== null) {
+        loadStateFromServer();
+        subscribeToServer();
+    } else {
+        loadStateFromQParams();
+    }
 })
 
 function getState() {
@@ -97,4 +221,16 @@ function setState(state) {
     document.querySelectorAll('.bingo_sq').forEach((node, i) => {
         node.className = "bingo_sq " + possible_states[state[i].charCodeAt(0)];
     });
-}
\ No newline at end of file
+}
+
+function setStateList(states) {
+    let possible_states = [
+        "inactive",
+        "active",
+        "blocked"
+    ];
+
+    document.querySelectorAll('.bingo_sq').forEach((node, i) => {
+        node.className = "bingo_sq " + possible_states[states[i]];
+    });
+}
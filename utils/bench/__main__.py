@@ -0,0 +1,47 @@
+import re
+import timeit
+
+from bc_bingo import BingoBoard
+
+def _strip(html):
+    return re.sub(r"\s+", "", html)
+
+def make_boards(nseeds, nsegs=7):
+    boards = []
+    for seed in range(nseeds):
+        for seg in range(1, nsegs + 1):
+            board = BingoBoard(f"segments/segment_{seg}.csv",
+                               seed=seed, segment=seg)
+            board.generate(seg)
+            boards.append(board)
+    return boards
+
+def bench(boards, number=5):
+    for board in boards:
+        assert _strip(board.render()) == _strip(board.render_compiled()), \
+            f"Compiled render differs for seed {board._seed}, " \
+            f"segment {board._seg}"
+
+    results = {}
+    for name, render in [("tree", lambda b: b.render()),
+                         ("compiled", lambda b: b.render_compiled())]:
+        elapsed = timeit.timeit(lambda: [render(b) for b in boards],
+                                number=number)
+        results[name] = elapsed / (number * len(boards))
+    return results
+
+if __name__ == "__main__":
+    import argparse
+    argp = argparse.ArgumentParser(
+        description="Compare tag tree and compiled board rendering.")
+    argp.add_argument("-s", "--seeds", type=int, default=50,
+                      help="Number of seeds to render all segments for.")
+    argp.add_argument("-n", "--number", type=int, default=5,
+                      help="Number of timing repetitions.")
+    args = argp.parse_args()
+
+    boards = make_boards(args.seeds)
+    results = bench(boards, args.number)
+    for name, per_board in results.items():
+        print(f"{name:>10}: {per_board * 1e6:10.1f} us / board")
+    print(f"{'speedup':>10}: {results['tree'] / results['compiled']:10.1f}x")
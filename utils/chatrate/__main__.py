@@ -0,0 +1,67 @@
+import sys
+import time
+import bisect
+import random
+import asyncio
+
+from chat_queue import ChatQueue, URGENT, NORMAL, BULK
+
+class Target:
+    def __init__(self):
+        self.times = []
+
+    async def send(self, msg):
+        self.times.append(time.monotonic())
+
+def max_in_window(times, period):
+    """
+    Most events in any `period` seconds long window.
+    """
+    times = sorted(times)
+    return max((bisect.bisect_left(times, t + period) - i
+                for i, t in enumerate(times)), default=0)
+
+async def flood(limit, period, nmessages):
+    """
+    Queue a burst of messages, then more while those are being sent, and
+    return the send times.
+    """
+    target = Target()
+    chat = ChatQueue(limit=limit, period=period)
+    chat.start()
+
+    priorities = [URGENT, NORMAL, BULK]
+    for i in range(nmessages // 2):
+        chat.send(target, f"message {i}", random.choice(priorities))
+    await asyncio.sleep(period / 2)
+    for i in range(nmessages // 2, nmessages):
+        chat.send(target, f"message {i}", random.choice(priorities))
+        await asyncio.sleep(random.random() * period / limit)
+
+    while len(chat):
+        await asyncio.sleep(0.01)
+    await chat.close()
+    return target.times
+
+if __name__ == "__main__":
+    import argparse
+    argp = argparse.ArgumentParser(
+        description="Check that no window of the chat rate limit period "
+                    "has more messages sent than the limit.")
+    argp.add_argument("-l", "--limit", type=int, default=20,
+                      help="Messages allowed per period.")
+    argp.add_argument("-p", "--period", type=float, default=3,
+                      help="Period in seconds, Twitch uses 30 but the "
+                           "check is the same scaled down.")
+    argp.add_argument("-n", "--messages", type=int, default=70,
+                      help="Number of messages to send.")
+    args = argp.parse_args()
+
+    times = asyncio.run(flood(args.limit, args.period, args.messages))
+    most = max_in_window(times, args.period)
+    if len(times) != args.messages or most > args.limit:
+        print(f"Sent {len(times)} of {args.messages} messages, at most "
+              f"{most} in {args.period}s (limit {args.limit}).")
+        sys.exit(1)
+    print(f"Sent {len(times)} messages, at most {most} in any "
+          f"{args.period}s (limit {args.limit}).")
@@ -1,11 +1,22 @@
 import csv
 
-def parse(fname):
-    with open(fname) as fin:
-        lines = fin.readlines()
+from pool_format import validate, write_pool, PoolFormatError
 
-    state = "header"
-    row_tmplt = {
+def _all_but_last(lines):
+    # The final line of a source file is never a square
+    lines = iter(lines)
+    prev = next(lines)
+    for line in lines:
+        yield prev
+        prev = line
+
+def parse_lines(lines):
+    """
+    Stream square rows out of the source text, given as an iterable of
+    lines.
+    """
+    lines = _all_but_last(lines)
+    row = {
         "index": 0,
         "square": None,
         "segment": None,
@@ -13,60 +24,78 @@ def parse(fname):
         "choices": None,
         "type": None,
     }
-    row = row_tmplt.copy()
-    squares = []
-    free = True
-    while True:
-        if row["segment"] is None:
-            row["segment"] = lines.pop(0).strip()
-            row["segment_index"] = int(row["segment"].split(" ")[1])
-            lines.pop(0)
-            continue
 
-        if free:
-            lines.pop(0)
-            lines.pop(0)
-            squares.append({
-                **row,
-                "square": lines.pop(0).strip(),
-                "type": "free",
-            })
-            row["index"] += 1
-            lines.pop(0)
-            free = False
-            continue
+    row["segment"] = next(lines).strip()
+    row["segment_index"] = int(row["segment"].split(" ")[1])
+    next(lines)
 
+    # The free square comes first
+    next(lines)
+    next(lines)
+    yield {
+        **row,
+        "square": next(lines).strip(),
+        "type": "free",
+    }
+    row["index"] += 1
+    next(lines)
+
+    for line in lines:
+        line = line.strip()
         if row["type"] is None:
-            #print("no type --- ", lines[0].strip())
-            #print(row)
-            type_, choices = lines.pop(0).strip().split(":")
+            type_, choices = line.split(":")
             row["type"], row["choices"] = type_.strip(), int(choices[1:-1].split(" ")[-1])
-            #print(row)
-            lines.pop(0)
+            next(lines)
             continue
-        
-        line = lines.pop(0).strip()
-        if len(lines) == 0:
-            break
 
         if line != "":
-            #print("with type --- ", lines[0].strip())
-            squares.append({
+            yield {
                 **row,
-                "square": line.strip(),
-            })
+                "square": line,
+            }
             row["index"] += 1
-            #print(squares[-1])
         else:
             row["type"] = None
 
-    return squares
+def parse(fname):
+    with open(fname) as fin:
+        yield from parse_lines(fin)
+
+def read_rows(fname):
+    """
+    Rows from either source text or an already converted CSV.
+    """
+    if fname.endswith(".csv"):
+        with open(fname, newline="") as csvfile:
+            yield from csv.DictReader(csvfile)
+    else:
+        yield from parse(fname)
 
 if __name__ == "__main__":
     import sys
+    import argparse
     from csv import DictWriter
 
-    squares = parse(sys.argv[-1])
+    argp = argparse.ArgumentParser(
+        description="Convert segment source text to CSV, or compile segment "
+                    "sources / CSVs into a binary pool file.")
+    argp.add_argument("sources", nargs="+",
+                      help="Segment source text or CSV files.")
+    argp.add_argument("-b", "--binary",
+                      help="Write a compiled pool file here instead of "
+                           "writing CSV to stdout.")
+    args = argp.parse_args()
+
+    squares = [row for fname in args.sources for row in read_rows(fname)]
+    try:
+        validate(squares)
+    except PoolFormatError as e:
+        print(f"Invalid pool:\n{e}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.binary is not None:
+        write_pool(args.binary, squares)
+        sys.exit()
 
     writer = DictWriter(sys.stdout, list(squares[0]))
     writer.writeheader()
@@ -0,0 +1,75 @@
+import sys
+import subprocess
+
+# entry point -> (import time budget in ms, modules it must not pull in)
+ENTRY_POINTS = {
+    "bot": (500, ["flask", "htmlBuilder", "markdown", "numpy", "bc_bingo"]),
+    "bc_bingo": (150, ["flask", "markdown", "numpy"]),
+    "server": (800, []),
+    "utils.convert.__main__": (100, ["flask", "htmlBuilder", "numpy",
+                                     "bc_bingo"]),
+}
+
+def import_times(module):
+    """
+    Import a module in a fresh interpreter and return
+    {module: cumulative import time in ms} for everything it loaded.
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime",
+                           "-c", f"import {module}"],
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Could not import {module}:\n{proc.stderr}")
+
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        try:
+            times[name.strip()] = int(cumulative) / 1000
+        except ValueError:
+            # the header line
+            continue
+    return times
+
+def check(module, budget, forbidden, repeat=3):
+    # Take the best of a few runs, the first one pays for cold caches
+    runs = [import_times(module) for _ in range(repeat)]
+    elapsed = min(times[module] for times in runs)
+    loaded = [name for name in forbidden
+              if any(name in times for times in runs)]
+
+    problems = []
+    if elapsed > budget:
+        problems.append(f"took {elapsed:.0f} ms, over {budget} ms")
+    if loaded:
+        problems.append(f"imported {', '.join(loaded)}")
+    return elapsed, problems
+
+if __name__ == "__main__":
+    import argparse
+    argp = argparse.ArgumentParser(
+        description="Check import time and import footprint of the entry "
+                    "points.")
+    argp.add_argument("modules", nargs="*", default=list(ENTRY_POINTS),
+                      help="Entry points to check (default all).")
+    argp.add_argument("-b", "--budget", type=int, default=None,
+                      help="Override the import time budget (ms).")
+    argp.add_argument("-r", "--repeat", type=int, default=3,
+                      help="Imports per entry point, the fastest counts.")
+    args = argp.parse_args()
+
+    failed = False
+    for module in args.modules:
+        budget, forbidden = ENTRY_POINTS.get(module, (500, []))
+        if args.budget is not None:
+            budget = args.budget
+        elapsed, problems = check(module, budget, forbidden, args.repeat)
+        status = "FAIL" if problems else "ok"
+        print(f"{module}: {elapsed:.0f} ms (budget {budget} ms) {status}")
+        for problem in problems:
+            print(f"    {problem}")
+        failed |= bool(problems)
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,53 @@
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from bc_bingo import BingoBoard
+
+def board_text(seed, seg):
+    board = BingoBoard(f"segments/segment_{seg}.csv", seed=seed, segment=seg)
+    board.generate(seg)
+    return [sq._text for col in board._board for sq in col]
+
+def stress(nseeds, nthreads, nsegs=7):
+    jobs = [(seed, seg) for seed in range(nseeds)
+                        for seg in range(1, nsegs + 1)]
+    expected = {job: board_text(*job) for job in jobs}
+
+    # Interleave jobs and poke the global generator from the side to make
+    # sure board generation doesn't depend on it
+    random.shuffle(jobs)
+    stop = threading.Event()
+    def meddle():
+        while not stop.is_set():
+            random.seed(random.random())
+    meddler = threading.Thread(target=meddle)
+    meddler.start()
+
+    try:
+        with ThreadPoolExecutor(max_workers=nthreads) as pool:
+            results = dict(zip(jobs, pool.map(lambda job: board_text(*job),
+                                              jobs)))
+    finally:
+        stop.set()
+        meddler.join()
+
+    return [job for job in jobs if results[job] != expected[job]]
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+    argp = argparse.ArgumentParser(
+        description="Check concurrent board generation against serial.")
+    argp.add_argument("-s", "--seeds", type=int, default=500,
+                      help="Number of seeds to generate all segments for.")
+    argp.add_argument("-t", "--threads", type=int, default=16,
+                      help="Number of generating threads.")
+    args = argp.parse_args()
+
+    mismatched = stress(args.seeds, args.threads)
+    if mismatched:
+        print(f"{len(mismatched)} boards differ from serial generation, "
+              f"e.g., (seed, segment) = {mismatched[0]}")
+        sys.exit(1)
+    print(f"All {args.seeds * 7} boards match serial generation.")